@@ -0,0 +1,110 @@
+import math
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+def snap_rbw(hz):
+    # analyzers accept RBW in a 1-3-10 sequence, round down to the nearest step
+    decade = 10 ** math.floor(math.log10(hz))
+    for step in (3, 1):
+        if hz >= step * decade:
+            return step * decade
+    return decade
+
+
+class AcquisitionProfile:
+
+    def __init__(self, name, label, min_snr, vbw_ratio, detector, adaptive=True, sweep_k=2.5):
+        self.name = name
+        self.label = label
+        self.min_snr = min_snr
+        self.vbw_ratio = vbw_ratio
+        self.detector = detector
+        self.adaptive = adaptive
+        self.sweep_k = sweep_k
+
+    def settings(self, span, noise_floor, level=None):
+        # noise_floor is the displayed noise level in dBm at the reference RBW of span / 100;
+        # a wider RBW raises it by 10*log10(rbw / rbw_ref): below min_snr every profile narrows the RBW,
+        # adaptive profiles also spend the margin above min_snr on speed
+        rbw_ref = span / 100
+        rbw = rbw_ref
+        if level is not None:
+            margin = level - noise_floor - self.min_snr
+            if margin < 0 or self.adaptive:
+                rbw = rbw_ref * 10 ** (margin / 10)
+        rbw = snap_rbw(min(max(rbw, span / 1000), span / 10))
+        vbw = snap_rbw(rbw * self.vbw_ratio)
+        return {
+            'rbw': rbw,
+            'vbw': vbw,
+            'detector': self.detector,
+            # a VBW below the RBW slows the sweep down as well, a sweep set too fast reads low
+            'sweep_time': max(self.sweep_k * span / (rbw * min(rbw, vbw)), 0.001),
+        }
+
+    @staticmethod
+    def noise_level(span, noise_floor, settings):
+        # displayed noise at the RBW actually set, same reference as settings()
+        return noise_floor + 10 * math.log10(settings['rbw'] / (span / 100))
+
+    @staticmethod
+    def commands(settings):
+        return [
+            f':SENS:BAND:RES {settings["rbw"]:g}Hz',
+            f':SENS:BAND:VID {settings["vbw"]:g}Hz',
+            f':SENS:DET {settings["detector"]}',
+            f':SENS:SWE:TIME {settings["sweep_time"]:g}s',
+            ':SENS:POW:RF:ATT:AUTO ON',
+        ]
+
+    @staticmethod
+    def key(name, settings):
+        rbw = settings['rbw']
+        rbw_str = f'{rbw / 1000:g}kHz' if rbw >= 1000 else f'{rbw:g}Hz'
+        return f'{name} RBW={rbw_str}'
+
+
+profiles = {
+    'fast': AcquisitionProfile('fast', 'быстро', min_snr=10, vbw_ratio=3, detector='POS'),
+    'normal': AcquisitionProfile('normal', 'норм.', min_snr=20, vbw_ratio=1, detector='POS'),
+    'precise': AcquisitionProfile('precise', 'точно', min_snr=30, vbw_ratio=0.1, detector='RMS', adaptive=False),
+}
+
+
+class PointTimer:
+
+    def __init__(self):
+        self._times = defaultdict(list)
+
+    def clear(self):
+        self._times.clear()
+
+    def copy(self):
+        other = PointTimer()
+        other._times.update((k, list(v)) for k, v in self._times.items())
+        return other
+
+    def add(self, key, seconds):
+        self._times[key].append(seconds)
+
+    @contextmanager
+    def measure(self, key):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(key, time.perf_counter() - start)
+
+    def summary(self):
+        return {
+            k: (len(v), sum(v) / len(v), sum(v))
+            for k, v in self._times.items()
+        }
+
+    @property
+    def report(self):
+        lines = [f'{k}: {n} т., {mean * 1000:0.0f} мс/т., {total:0.1f} с' for k, (n, mean, total) in self.summary().items()]
+        return '\n'.join(['Профили анализатора:'] + lines)
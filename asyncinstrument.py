@@ -0,0 +1,122 @@
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from canceltoken import TaskCancelled
+
+
+# one I/O thread and one lock per instrument:
+# commands to different addresses overlap, commands to the same one stay ordered
+class AsyncInstrument:
+
+    def __init__(self, instrument):
+        self._instrument = instrument
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._lock = None
+
+    def __getattr__(self, item):
+        return getattr(self._instrument, item)
+
+    @property
+    def lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _call(self, fn, *args):
+        future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # the transfer cannot be interrupted, hold the lock until the instrument is done with it
+            await asyncio.wait([future])
+            raise
+
+    async def send(self, command):
+        async with self.lock:
+            return await self._call(self._instrument.send, command)
+
+    async def query(self, question):
+        async with self.lock:
+            return await self._call(self._instrument.query, question)
+
+    async def batch(self, *commands):
+        # commands are sent back to back without other tasks interleaving on this instrument
+        async with self.lock:
+            for command in commands:
+                await self._call(self._instrument.send, command)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class EventLoopThread(QObject):
+    taskFailed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent=parent)
+        self._loop = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='instrument-io', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=1)
+        self._thread = None
+
+    def submit(self, coro):
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        if future.cancelled():
+            return
+        ex = future.exception()
+        if ex is not None:
+            self.taskFailed.emit(f'{type(ex).__name__}: {ex}')
+
+    def run(self, coro, token=None, poll=0.005):
+        # blocks the calling (worker) thread, cancelling the coroutine when the token fires
+        if token is None:
+            return self.submit(coro).result()
+
+        done = threading.Event()
+
+        async def _spawn():
+            task = asyncio.ensure_future(coro)
+            task.add_done_callback(self._on_done)
+            task.add_done_callback(lambda _: done.set())
+            return task
+
+        self.start()
+        task = asyncio.run_coroutine_threadsafe(_spawn(), self._loop).result()
+        while not done.is_set():
+            if token.wait(poll):
+                # the task unwinds only after the instrument call it is in returns,
+                # wait for that so the caller's teardown does not talk over a transfer in flight
+                self._loop.call_soon_threadsafe(task.cancel)
+                done.wait()
+                raise TaskCancelled('task cancelled')
+        return task.result()
+
+    def gather(self, *coros, token=None):
+        async def _gather():
+            return await asyncio.gather(*coros)
+        return self.run(_gather(), token=token)
@@ -0,0 +1,36 @@
+import threading
+
+
+class TaskCancelled(RuntimeError):
+    pass
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    @cancelled.setter
+    def cancelled(self, value):
+        if value:
+            self._event.set()
+        else:
+            self._event.clear()
+
+    def cancel(self):
+        self._event.set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def check(self, message='task cancelled'):
+        if self._event.is_set():
+            raise TaskCancelled(message)
+
+    def sleep(self, seconds, message='task cancelled'):
+        # interruptible replacement for time.sleep: returns as soon as the token is cancelled
+        if self._event.wait(seconds):
+            raise TaskCancelled(message)
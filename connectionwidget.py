@@ -2,6 +2,7 @@ from PyQt5 import uic
 from PyQt5.QtCore import pyqtSlot, pyqtSignal, QRunnable, QThreadPool
 from PyQt5.QtWidgets import QWidget
 
+from canceltoken import CancelToken
 from instrumentwidget import InstrumentWidget
 
 
@@ -29,6 +30,7 @@ class ConnectionWidget(QWidget):
         self._ui = uic.loadUi('connectionwidget.ui', self)
         self._controller = controller
         self._threads = QThreadPool()
+        self._token = CancelToken()
 
         self._widgets = {
             k: InstrumentWidget(parent=self, title=f'{k}', addr=f'{v.addr}')
@@ -37,6 +39,8 @@ class ConnectionWidget(QWidget):
 
         self._setupUi()
 
+        self._controller.instrumentStateChanged.connect(self.on_instrumentStateChanged)
+
     def _setupUi(self):
         for i, iw in enumerate(self._widgets.items()):
             self._ui.layInstruments.insertWidget(i, iw[1])
@@ -45,9 +49,21 @@ class ConnectionWidget(QWidget):
     def on_btnConnect_clicked(self):
         print('connect')
 
+        self._token = CancelToken()
         self._threads.start(ConnectTask(self._controller.connect,
                                         self.connectTaskComplete,
-                                        {k: w.address for k, w in self._widgets.items()}))
+                                        {k: w.address for k, w in self._widgets.items()},
+                                        self._token))
+
+    def cancel(self):
+        self._token.cancel()
+
+    def waitForDone(self, msecs=-1):
+        return self._threads.waitForDone(msecs)
+
+    @pyqtSlot(str, bool)
+    def on_instrumentStateChanged(self, name, healthy):
+        self._widgets[name].status = 'подключен' if healthy else 'переподключение...'
 
     @pyqtSlot(bool)
     def on_grpInstruments_toggled(self, state):
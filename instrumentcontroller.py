@@ -1,29 +1,57 @@
 import ast
+import asyncio
+import logging
+import os
+import sqlite3
 import time
 
 import numpy as np
 
 from collections import defaultdict
+from contextlib import contextmanager
 from PyQt5.QtCore import QObject, pyqtSlot, pyqtSignal
 
+from acquisitionprofile import AcquisitionProfile, profiles
+from asyncinstrument import AsyncInstrument, EventLoopThread
+from canceltoken import CancelToken, TaskCancelled
 from instr.instrumentfactory import mock_enabled, GeneratorFactory, SourceFactory, \
     MultimeterFactory, AnalyzerFactory
+from instrumentsession import InstrumentSession, InstrumentReconnected, SessionMonitor
 from measureresult import MeasureResult
-from forgot_again.file import load_ast_if_exists, pprint_to_file
+from resultarchive import ResultArchive, calibration_id
+from riglock import RigLock
+from runningstats import LevelAverage
+from scpicapture import ScpiCapture, ReplayCapture
+from speclimits import SpecFailed
+from sweepplan import SweepPlan, TimingModel, EtaTracker, format_duration, sweep_modes
+from switchmatrix import SwitchMatrixFactory, close_command
+from tracestore import TraceStore
+from forgot_again.file import load_ast_if_exists, pprint_to_file, make_dirs
+from forgot_again.string import now_timestamp
+
+log = logging.getLogger('rig.measure')
+log_cal = logging.getLogger('rig.calibrate')
+log_point = logging.getLogger('rig.point')
 
 
 class InstrumentController(QObject):
     pointReady = pyqtSignal()
+    instrumentStateChanged = pyqtSignal(str, bool)
 
     def __init__(self, parent=None):
         super().__init__(parent=parent)
 
+        # the GUI and the rig service each build a controller, only one of them may own the rig
+        self._rig_lock = RigLock('instr.ini.lock')
+        self._rig_lock.acquire()
+
         addrs = load_ast_if_exists('instr.ini', default={
             'Анализатор': 'GPIB1::18::INSTR',
             'P LO': 'GPIB1::6::INSTR',
             'P RF': 'GPIB1::20::INSTR',
             'Источник': 'GPIB1::3::INSTR',
             'Мультиметр': 'GPIB1::22::INSTR',
+            'Коммутатор': 'GPIB1::9::INSTR',
         })
 
         self.requiredInstruments = {
@@ -32,7 +60,11 @@ class InstrumentController(QObject):
             'P RF': GeneratorFactory(addrs['P RF']),
             'Источник': SourceFactory(addrs['Источник']),
             'Мультиметр': MultimeterFactory(addrs['Мультиметр']),
+            'Коммутатор': SwitchMatrixFactory(addrs.get('Коммутатор', 'GPIB1::9::INSTR')),
         }
+        # single-DUT runs do not need the switch matrix, connecting succeeds without it
+        self.optionalInstruments = {'Коммутатор'}
+        self.switch_settle = 0.02
 
         self.deviceParams = {
             '+25': {
@@ -67,61 +99,136 @@ class InstrumentController(QObject):
             'loss': 0.82,
             'ref_lev': 10.0,
             'scale_y': 5.0,
+            'spec_policy': 'continue',
+            'mult_range': 1.0,
+            'mult_nplc': 1.0,
+            'mult_autozero': 'ONCE',
+            'sa_profile': 'normal',
+            'sa_noise_floor': -100.0,
+            'sa_sync': True,
+            'sa_trace_capture': False,
+            'avg_target': 0.0,
+            'avg_max': 16,
+            'dut_count': 1,
+            'cal_lo_maxhold': False,
+            'sweep_mode': 'zip',
+            'f_if': 0.0,
         })
 
         self._calibrated_pows_lo = load_ast_if_exists('cal_lo.ini', default={})
         self._calibrated_pows_rf = load_ast_if_exists('cal_rf.ini', default={})
 
         self._instruments = dict()
+        self._async_instruments = dict()
+        self.io = EventLoopThread(parent=self)
+        self._monitor = SessionMonitor(self._instruments)
+        self.point_retries = 2
+        self.visited_frequencies = 0
+        # dB above the profile SNR at which a single marker reading is left unaveraged
+        self.avg_clean_margin = 10.0
         self.found = False
         self.present = False
         self.hasResult = False
         self.only_main_states = False
 
+        self.capture = None
+        self.replaying = False
+        self.trace_path = None
+
         self.result = MeasureResult()
+        self.archive = ResultArchive('archive.db')
+        self.timing = TimingModel('timing.ini')
+        self.eta = EtaTracker()
 
     def __str__(self):
         return f'{self._instruments}'
 
-    def connect(self, addrs):
-        print(f'searching for {addrs}')
+    def connect(self, addrs, token=None):
+        log.info('searching for %s', addrs)
         for k, v in addrs.items():
             self.requiredInstruments[k].addr = v
-        self.found = self._find()
-
-    def _find(self):
-        self._instruments = {
-            k: v.find() for k, v in self.requiredInstruments.items()
+        try:
+            self.found = self._find(token or CancelToken())
+        except TaskCancelled as ex:
+            log.error('runtime error: %s', ex)
+            self.found = False
+
+    def record(self, path):
+        # every send/query of the instruments found on the next connect goes to the capture file
+        if self.capture is not None:
+            self.capture.close()
+        self.capture = ScpiCapture(path)
+
+    def replay(self, path, speed=None):
+        # serve a recorded session instead of the rig, speed=1.0 keeps the original timing
+        capture = ReplayCapture(path, speed)
+        self.requiredInstruments = {k: capture.factory(k) for k in self.requiredInstruments}
+        self.replaying = True
+        log.info('replaying %s, instruments %s', path, capture.instruments)
+
+    def _find(self, token):
+        self._monitor.stop()
+        self._instruments = dict()
+        for k, v in self.requiredInstruments.items():
+            token.check('search cancelled')
+            if self.capture is not None:
+                v = self.capture.factory(k, v)
+            inst = v.find()
+            if inst:
+                inst = InstrumentSession(k, v, inst)
+                inst.on_state_changed = self.instrumentStateChanged.emit
+            self._instruments[k] = inst
+
+        for inst in self._async_instruments.values():
+            inst.close()
+        self._async_instruments = {
+            k: AsyncInstrument(v) for k, v in self._instruments.items() if v
         }
-        return all(self._instruments.values())
+        self._monitor = SessionMonitor({k: v for k, v in self._instruments.items() if v})
+        # a replay has no connection to keep alive; while recording the pings bypass the capture
+        if not self.replaying:
+            self._monitor.start()
+        return all(v for k, v in self._instruments.items() if k not in self.optionalInstruments)
 
     def check(self, token, params):
-        print(f'call check with {token} {params}')
+        log.info('call check with %s', params)
         device, secondary = params
-        self.present = self._check(token, device, secondary)
-        print('sample pass')
+        try:
+            with self._sessions_token(token):
+                self.present = self._check(token, device, secondary)
+        except RuntimeError as ex:
+            log.error('runtime error: %s', ex)
+            self.present = False
+            return
+        log.info('sample pass')
 
     def _check(self, token, device, secondary):
-        print(f'launch check with {self.deviceParams[device]} {self.secondaryParams}')
-        self._init()
+        log.debug('launch check with %s %s', self.deviceParams[device], self.secondaryParams)
+        self._init(token)
         return True
 
+    def calibrate(self, token, what, params):
+        log_cal.info('call calibrate %s with %s', what, params)
+        fn = self._calibrateLO if what == 'LO' else self._calibrateRF
+        try:
+            with self._sessions_token(token):
+                fn(token, params)
+        except RuntimeError as ex:
+            log.error('runtime error: %s', ex)
+
     def _calibrateLO(self, token, secondary):
-        print('run calibrate LO with', secondary)
+        log_cal.debug('run calibrate LO with %s', secondary)
 
         gen_lo = self._instruments['P LO']
         sa = self._instruments['Анализатор']
 
         secondary = self.secondaryParams
+        plan = SweepPlan(secondary)
+        if secondary.get('cal_lo_maxhold', False):
+            return self._calibrateLO_maxhold(token, secondary, plan)
 
-        pow_lo = secondary['Plo']
+        pow_lo = plan.pow_lo
         freq_lo_start = secondary['Flo_min']
-        freq_lo_end = secondary['Flo_max']
-        freq_lo_step = secondary['Flo_delta']
-        freq_lo_x2 = secondary['is_Flo_x2']
-
-        freq_lo_values = [round(x, 3) for x in
-                          np.arange(start=freq_lo_start, stop=freq_lo_end + 0.0001, step=freq_lo_step)]
 
         sa.send(':CAL:AUTO OFF')
         sa.send(':SENS:FREQ:SPAN 1MHz')
@@ -129,70 +236,163 @@ class InstrumentController(QObject):
         sa.send(f'DISP:WIND:TRAC:Y:PDIV 5')
         sa.send(':CALC:MARK1:MODE POS')
 
+        sync = secondary.get('sa_sync', True)
+        sa.send(f'INIT:CONT {"OFF" if sync else "ON"}')
+
         gen_lo.send(f':OUTP:MOD:STAT OFF')
         gen_lo.send(f'SOUR:POW {pow_lo}dbm')
 
+        def read_point(freq):
+            gen_lo.send(f'SOUR:FREQ {freq}GHz')
+            gen_lo.send(f'OUTP:STAT ON')
+
+            if self._settling:
+                token.sleep(0.35, 'calibration cancelled')
+
+            sa.send(f':SENSe:FREQuency:CENTer {freq}GHz')
+            sa.send(f':CALCulate:MARKer1:X:CENTer {freq}GHz')
+
+            self._sa_wait_sweep(sa, token, sync, 0.35, 'calibration cancelled')
+
+            return float(sa.query(':CALCulate:MARKer:Y?'))
+
         result = {}
-        for freq in freq_lo_values:
+        try:
+            for freq in plan.cal_lo_values:
+                token.check('calibration cancelled')
 
-            if freq_lo_x2:
-                freq *= 2
+                pow_read = self._run_cal_point(read_point, freq)
+                loss = abs(pow_lo - pow_read)
+                if mock_enabled:
+                    loss = 10
 
-            if token.cancelled:
-                gen_lo.send(f'OUTP:STAT OFF')
-                time.sleep(0.5)
+                log_point.debug('loss: %s @ %s GHz', loss, freq)
+                result[freq] = loss
+        except Exception:
+            self._calibration_teardown(gen_lo, pow_lo, freq_lo_start)
+            raise
 
-                gen_lo.send(f'SOUR:POW {pow_lo}dbm')
+        if not self.replaying:
+            pprint_to_file('cal_lo.ini', result)
 
-                gen_lo.send(f'SOUR:FREQ {freq_lo_start}GHz')
-                raise RuntimeError('calibration cancelled')
+        gen_lo.send(f'OUTP:STAT OFF')
+        sa.send(':CAL:AUTO ON')
+        sa.send('INIT:CONT ON')
+        self._calibrated_pows_lo = result
+        return True
 
-            gen_lo.send(f'SOUR:FREQ {freq}GHz')
-            gen_lo.send(f'OUTP:STAT ON')
+    def _calibrateLO_maxhold(self, token, secondary, plan):
+        # one wide max-hold trace over Flo_min..Flo_max while the generator steps through the list,
+        # then every LO level is picked from that single trace readout
+        gen_lo = self._instruments['P LO']
+        sa = self._instruments['Анализатор']
 
-            if not mock_enabled:
-                time.sleep(0.35)
+        pow_lo = plan.pow_lo
+        freq_lo_start = secondary['Flo_min']
+        freq_lo_step = secondary['Flo_delta']
+        freq_lo_values = plan.cal_lo_values
 
-            sa.send(f':SENSe:FREQuency:CENTer {freq}GHz')
-            sa.send(f':CALCulate:MARKer1:X:CENTer {freq}GHz')
+        span_start = max(min(freq_lo_values) - freq_lo_step / 2, 0.0)
+        span_stop = max(freq_lo_values) + freq_lo_step / 2
+        sweep_points = int(min(max(20 * len(freq_lo_values) + 1, 1001), 40001))
 
-            if not mock_enabled:
-                time.sleep(0.35)
+        # the wide span, the long trace and the detector would otherwise stay for the next measurement
+        restore = [] if mock_enabled else [
+            f':SENS:FREQ:CENT {sa.query(":SENS:FREQ:CENT?").strip()}',
+            f':SENS:FREQ:SPAN {sa.query(":SENS:FREQ:SPAN?").strip()}',
+            f':SENS:SWE:POIN {sa.query(":SENS:SWE:POIN?").strip()}',
+            f':SENS:DET {sa.query(":SENS:DET?").strip()}',
+        ]
+
+        sa.send(':CAL:AUTO OFF')
+        sa.send(f':SENS:FREQ:STAR {span_start}GHz')
+        sa.send(f':SENS:FREQ:STOP {span_stop}GHz')
+        sa.send(f':SENS:SWE:POIN {sweep_points}')
+        sa.send(':SENS:DET POS')
+        sa.send(f'DISP:WIND:TRAC:Y:RLEV 10')
+        sa.send(f'DISP:WIND:TRAC:Y:PDIV 5')
+        sa.send(':FORM ASC')
+        sa.send(':TRAC1:TYPE MAXH')
+        sa.send('INIT:CONT ON')
+
+        gen_lo.send(f':OUTP:MOD:STAT OFF')
+        gen_lo.send(f'SOUR:POW {pow_lo}dbm')
 
-            pow_read = float(sa.query(':CALCulate:MARKer:Y?'))
-            loss = abs(pow_lo - pow_read)
+        # the tone must stay put for at least one full sweep for max-hold to catch it
+        dwell = 0.05 if mock_enabled else float(sa.query(':SENS:SWE:TIME?')) * 1.2 + 0.05
+        if self.replaying:
+            dwell = 0.0
+
+        try:
+            gen_lo.send(f'SOUR:FREQ {freq_lo_values[0]}GHz')
+            gen_lo.send(f'OUTP:STAT ON')
+            for freq in freq_lo_values:
+                token.check('calibration cancelled')
+                gen_lo.send(f'SOUR:FREQ {freq}GHz')
+                token.sleep(dwell, 'calibration cancelled')
+
+            sa.send('INIT:CONT OFF')
             if mock_enabled:
-                loss = 10
+                levels = [pow_lo - 10] * len(freq_lo_values)
+            else:
+                sa.query('*OPC?')
+                trace = np.array(sa.query(':TRAC:DATA? TRACE1').split(','), dtype=float)
+                levels = _trace_levels(trace, span_start, span_stop, freq_lo_values)
+        except Exception:
+            # a max-hold trace does not survive a reconnect, the whole calibration has to be run again
+            self._calibration_teardown(gen_lo, pow_lo, freq_lo_start, restore=[':TRAC1:TYPE WRIT'] + restore)
+            raise
+
+        sa.send(':TRAC1:TYPE WRIT')
+        for command in restore:
+            sa.send(command)
+        sa.send(':CAL:AUTO ON')
+        sa.send('INIT:CONT ON')
 
-            print('loss: ', loss)
-            result[freq] = loss
+        result = {freq: round(abs(pow_lo - level), 3) for freq, level in zip(freq_lo_values, levels)}
+        log_cal.info('loss: %s', result)
 
-        pprint_to_file('cal_lo.ini', result)
+        if not self.replaying:
+            pprint_to_file('cal_lo.ini', result)
 
         gen_lo.send(f'OUTP:STAT OFF')
-        sa.send(':CAL:AUTO ON')
         self._calibrated_pows_lo = result
         return True
 
+    def _run_cal_point(self, fn, *args):
+        for attempt in range(self.point_retries + 1):
+            try:
+                return fn(*args)
+            except InstrumentReconnected as ex:
+                if attempt == self.point_retries:
+                    raise
+                log_cal.warning('retrying calibration point %s: %s', args, ex)
+
+    def _calibration_teardown(self, gen, pow_start, freq_start, restore=()):
+        # generator off and the analyzer back to free run, whatever stopped the calibration
+        sa = self._instruments['Анализатор']
+        try:
+            gen.send(f'OUTP:STAT OFF')
+            gen.send(f'SOUR:POW {pow_start}dbm')
+            gen.send(f'SOUR:FREQ {freq_start}GHz')
+            for command in restore:
+                sa.send(command)
+            sa.send(':CAL:AUTO ON')
+            sa.send('INIT:CONT ON')
+        except Exception as ex:
+            log_cal.error('calibration teardown failed: %s', ex)
+
     def _calibrateRF(self, token, secondary):
-        print('run calibrate RF with', secondary)
+        log_cal.debug('run calibrate RF with %s', secondary)
 
         gen_rf = self._instruments['P RF']
         sa = self._instruments['Анализатор']
 
         secondary = self.secondaryParams
+        plan = SweepPlan(secondary)
 
         pow_rf_start = secondary['Prf_min']
-        pow_rf_end = secondary['Prf_max']
-        pow_rf_step = secondary['Prf_delta']
-
         freq_rf_start = secondary['Frf_min']
-        freq_rf_end = secondary['Frf_max']
-        freq_rf_step = secondary['Frf_delta']
-
-        pow_rf_values = [round(x, 3) for x in np.arange(start=pow_rf_start, stop=pow_rf_end + 0.002, step=pow_rf_step)]
-        freq_rf_values = [round(x, 3) for x in
-                          np.arange(start=freq_rf_start, stop=freq_rf_end + 0.002, step=freq_rf_step)]
 
         sa.send(':CAL:AUTO OFF')
         sa.send(':SENS:FREQ:SPAN 1MHz')
@@ -200,64 +400,112 @@ class InstrumentController(QObject):
         sa.send(f'DISP:WIND:TRAC:Y:PDIV 5')
         sa.send(':CALC:MARK1:MODE POS')
 
-        result = defaultdict(dict)
-        for freq in freq_rf_values:
-            gen_rf.send(f'SOUR:FREQ {freq}GHz')
-
-            for pow_rf in pow_rf_values:
-                if token.cancelled:
-                    gen_rf.send(f'OUTP:STAT OFF')
+        sync = secondary.get('sa_sync', True)
+        sa.send(f'INIT:CONT {"OFF" if sync else "ON"}')
 
-                    time.sleep(0.5)
+        def read_point(freq, pow_rf):
+            # the frequency is set again on every point, a retried point may follow a reconnect
+            gen_rf.send(f'SOUR:FREQ {freq}GHz')
+            gen_rf.send(f'SOUR:POW {pow_rf}dbm')
+            gen_rf.send(f'OUTP:STAT ON')
 
-                    gen_rf.send(f'SOUR:POW {pow_rf_start}dbm')
-                    gen_rf.send(f'SOUR:FREQ {freq_rf_start}GHz')
-                    raise RuntimeError('calibration cancelled')
+            if self._settling:
+                token.sleep(0.35, 'calibration cancelled')
 
-                gen_rf.send(f'SOUR:POW {pow_rf}dbm')
-                gen_rf.send(f'OUTP:STAT ON')
+            sa.send(f':SENSe:FREQuency:CENTer {freq}GHz')
+            sa.send(f':CALCulate:MARKer1:X:CENTer {freq}GHz')
 
-                if not mock_enabled:
-                    time.sleep(0.35)
+            self._sa_wait_sweep(sa, token, sync, 0.35, 'calibration cancelled')
 
-                sa.send(f':SENSe:FREQuency:CENTer {freq}GHz')
-                sa.send(f':CALCulate:MARKer1:X:CENTer {freq}GHz')
+            return float(sa.query(':CALCulate:MARKer:Y?'))
 
-                if not mock_enabled:
-                    time.sleep(0.35)
+        result = defaultdict(dict)
+        try:
+            for freq in plan.rf_values:
+                for pow_rf in plan.pow_values:
+                    token.check('calibration cancelled')
 
-                pow_read = float(sa.query(':CALCulate:MARKer:Y?'))
-                loss = abs(pow_rf - pow_read)
-                if mock_enabled:
-                    loss = 10
+                    pow_read = self._run_cal_point(read_point, freq, pow_rf)
+                    loss = abs(pow_rf - pow_read)
+                    if mock_enabled:
+                        loss = 10
 
-                print('loss: ', loss)
-                result[freq][pow_rf] = loss
+                    log_point.debug('loss: %s @ %s GHz %s dBm', loss, freq, pow_rf)
+                    result[freq][pow_rf] = loss
+        except Exception:
+            self._calibration_teardown(gen_rf, pow_rf_start, freq_rf_start)
+            raise
 
         result = {k: v for k, v in result.items()}
-        pprint_to_file('cal_rf.ini', result)
+        if not self.replaying:
+            pprint_to_file('cal_rf.ini', result)
 
         gen_rf.send(f'OUTP:STAT OFF')
         sa.send(':CAL:AUTO ON')
+        sa.send('INIT:CONT ON')
         self._calibrated_pows_rf = result
         return True
 
     def measure(self, token, params):
-        print(f'call measure with {token} {params}')
+        log.info('call measure with %s', params)
         device, _ = params
+        self.hasResult = False
         try:
             self.result.set_secondary_params(self.secondaryParams)
             self.result.set_primary_params(self.deviceParams[device])
-            self._measure(token, device)
+            with self._sessions_token(token):
+                self._measure(token, device)
             # self.hasResult = bool(self.result)
             self.hasResult = True  # HACK
         except RuntimeError as ex:
-            print('runtime error:', ex)
+            log.error('runtime error: %s', ex)
+            return
+        # a replayed session is a rerun of a recorded one: its pace would skew the timing model,
+        # and the run is already in the archive
+        if self.replaying:
+            return
+        if not mock_enabled:
+            readings = sum(result.point_count for result in self.result.by_dut().values())
+            self.timing.add_run(readings, self.visited_frequencies, self.eta.elapsed)
+        self._archive_result(device)
+
+    def plan_summary(self, params):
+        try:
+            plan = SweepPlan(params, self._calibrated_pows_lo, self._calibrated_pows_rf)
+        except (KeyError, ValueError, ZeroDivisionError) as ex:
+            return f'ошибка параметров: {ex}'
+        text = f'{sweep_modes.get(plan.mode, plan.mode)}: ' \
+               f'{plan.frequency_count} част. x {len(plan.pow_values)} = {plan.point_count} т., ' \
+               f'~{format_duration(self.timing.estimate(plan, params.get("dut_count", 1)))}'
+        if plan.fixed_if is not None:
+            text += f', ПЧ {plan.fixed_if} ГГц'
+        if plan.dropped:
+            text += f', {plan.dropped} част. без пары'
+        if plan.uncalibrated:
+            text += f', {plan.uncalibrated} Fгет вне калибровки'
+        if params.get('dut_count', 1) > 1:
+            text += f', {params["dut_count"]} DUT через коммутатор'
+        return text
+
+    def _archive_result(self, device):
+        results = self.result.by_dut()
+        try:
+            for dut, result in results.items():
+                run_id = self.archive.store(
+                    result.raw_points,
+                    device='demod' if len(results) == 1 else f'demod-dut{dut}',
+                    corner=device,
+                    params=self.secondaryParams,
+                    calibration=calibration_id(self._calibrated_pows_lo, self._calibrated_pows_rf),
+                )
+                log.info('archived run %s', run_id)
+        except sqlite3.Error as ex:
+            log.error('archive error: %s', ex)
 
     def _measure(self, token, device):
         param = self.deviceParams[device]
         secondary = self.secondaryParams
-        print(f'launch measure with {token} {param} {secondary}')
+        log.debug('launch measure with %s %s', param, secondary)
 
         self._clear()
         self._measure_s_params(token, param, secondary)
@@ -266,12 +514,24 @@ class InstrumentController(QObject):
     def _clear(self):
         self.result.clear()
 
-    def _init(self):
-        self._instruments['P LO'].send('*RST')
-        self._instruments['P RF'].send('*RST')
-        self._instruments['Источник'].send('*RST')
-        self._instruments['Мультиметр'].send('*RST')
-        self._instruments['Анализатор'].send('*RST')
+    @contextmanager
+    def _sessions_token(self, token):
+        # a reconnect started by the task gives up as soon as the task is cancelled
+        sessions = [v for v in self._instruments.values() if v]
+        for session in sessions:
+            session.token = token
+        try:
+            yield
+        finally:
+            for session in sessions:
+                session.token = None
+
+    def _init(self, token):
+        for name in ['P LO', 'P RF', 'Источник', 'Мультиметр', 'Анализатор']:
+            token.check('init cancelled')
+            self._instruments[name].send('*RST')
+        if self._instruments.get('Коммутатор'):
+            self._instruments['Коммутатор'].send('*RST')
 
     def _measure_s_params(self, token, param, secondary):
         gen_lo = self._instruments['P LO']
@@ -285,19 +545,11 @@ class InstrumentController(QObject):
         src_u_d = secondary['UsrcD']
         src_i_d = 20  # mA
 
-        pow_lo = secondary['Plo']
-        freq_lo_start = secondary['Flo_min']
-        freq_lo_end = secondary['Flo_max']
-        freq_lo_step = secondary['Flo_delta']
-        freq_lo_x2 = secondary['is_Flo_x2']
+        plan = SweepPlan(secondary, self._calibrated_pows_lo, self._calibrated_pows_rf)
 
+        pow_lo = plan.pow_lo
         pow_rf_start = secondary['Prf_min']
-        pow_rf_end = secondary['Prf_max']
-        pow_rf_step = secondary['Prf_delta']
-
         freq_rf_start = secondary['Frf_min']
-        freq_rf_end = secondary['Frf_max']
-        freq_rf_step = secondary['Frf_delta']
 
         ref_level = secondary['ref_lev']
         scale_y = secondary['scale_y']
@@ -305,11 +557,17 @@ class InstrumentController(QObject):
         p_loss = secondary['loss']
         d = secondary['D']
 
-        pow_rf_values = [round(x, 3) for x in np.arange(start=pow_rf_start, stop=pow_rf_end + 0.002, step=pow_rf_step)]
-        freq_lo_values = [round(x, 3) for x in
-                          np.arange(start=freq_lo_start, stop=freq_lo_end + 0.002, step=freq_lo_step)]
-        freq_rf_values = [round(x, 3) for x in
-                          np.arange(start=freq_rf_start, stop=freq_rf_end + 0.002, step=freq_rf_step)]
+        sa_span = 1_000_000
+        sa_sync = secondary.get('sa_sync', True)
+        profile = profiles.get(secondary.get('sa_profile', 'normal'), profiles['normal'])
+        noise_floor = secondary.get('sa_noise_floor', -100.0)
+        avg_target, avg_max = secondary.get('avg_target', 0.0), secondary.get('avg_max', 16)
+
+        dut_count = secondary.get('dut_count', 1)
+        if dut_count > 1 and not self._instruments.get('Коммутатор'):
+            raise RuntimeError(f'{dut_count} DUTs need the switch matrix, it is not connected')
+        # switch channel per DUT, None: no switching, the single DUT is wired directly
+        duts = tuple(range(1, dut_count + 1)) if dut_count > 1 else (None,)
 
         src.send(f'APPLY p6v,{src_u}V,{src_i}mA')
         src.send(f'APPLY p25v,{src_u_d}V,{src_i_d}mA')
@@ -329,103 +587,236 @@ class InstrumentController(QObject):
         gen_rf.send(f':FREQ:MULT {gen_f_mult}')
         gen_lo.send(f':FREQ:MULT {gen_f_mult}')
 
-        if mock_enabled:
-            with open('./mock_data/-5db.txt', mode='rt', encoding='utf-8') as f:
-                index = 0
-                mocked_raw_data = ast.literal_eval(''.join(f.readlines()))
-
-        res = []
-        for freq_lo, freq_rf in zip(freq_lo_values, freq_rf_values):
-
-            freq_rf_label = float(freq_rf)
-            if freq_lo_x2:
-                freq_lo *= 2
-
-            gen_lo.send(f'SOUR:FREQ {freq_lo}GHz')
-
-            delta_lo = round(self._calibrated_pows_lo.get(freq_lo, 0) / 2, 2)
-            print('delta LO:', delta_lo)
-            gen_lo.send(f'SOUR:POW {pow_lo + delta_lo}dbm')
-
-            gen_rf.send(f'SOUR:FREQ {freq_rf}GHz')
-
-            for pow_rf in pow_rf_values:
-
-                if token.cancelled:
-                    gen_lo.send(f'OUTP:STAT OFF')
-                    gen_rf.send(f'OUTP:STAT OFF')
-
-                    if not mock_enabled:
-                        time.sleep(0.5)
-
-                    src.send('OUTPut OFF')
-
-                    gen_rf.send(f'SOUR:POW {pow_rf_start}dbm')
-                    gen_lo.send(f'SOUR:POW {pow_lo}dbm')
-
-                    gen_rf.send(f'SOUR:FREQ {freq_rf_start}GHz')
-                    gen_lo.send(f'SOUR:FREQ {freq_rf_start}GHz')
-
-                    sa.send(':CAL:AUTO ON')
-                    raise RuntimeError('measurement cancelled')
-
-                delta_rf = round(self._calibrated_pows_rf.get(freq_rf, dict()).get(pow_rf, 0) / 2, 2)
-                print('delta RF:', delta_rf)
-                gen_rf.send(f'SOUR:POW {pow_rf + delta_rf}dbm')
-
-                src.send('OUTPut ON')
+        self._configure_multimeter(mult, secondary)
 
-                gen_lo.send(f'OUTP:STAT ON')
-                gen_rf.send(f'OUTP:STAT ON')
+        sa_settings = profile.settings(sa_span, noise_floor)
+        for command in profile.commands(sa_settings):
+            sa.send(command)
+        # constant IF: the analyzer stays put, points only retune the generators
+        log.info('sweep mode %s, fixed IF %s', plan.mode, plan.fixed_if)
+        for command in plan.if_commands:
+            sa.send(command)
+        # single sweeps: every marker read comes from a sweep started after the generators settled
+        sa.send(f'INIT:CONT {"OFF" if sa_sync else "ON"}')
 
-                time.sleep(0.1)
-                if not mock_enabled:
-                    time.sleep(0.5)
+        traces = None
+        if secondary.get('sa_trace_capture', False) and not mock_enabled:
+            traces = self._create_trace_store(sa, plan, len(duts))
 
-                i_mul_read = float(mult.query('MEAS:CURR:DC? 1A,DEF'))
-
-                center_freq = (freq_rf - freq_lo) if not freq_lo_x2 else (freq_rf - freq_lo / 2)
-                # center_freq /= 2
-                sa.send(':CALC:MARK1:MODE POS')
-                sa.send(f':SENSe:FREQuency:CENTer {center_freq}GHz')
-                sa.send(f':CALCulate:MARKer1:X:CENTer {center_freq}GHz')
-
-                if not mock_enabled:
-                    time.sleep(0.5)
-
-                pow_read = float(sa.query(':CALCulate:MARKer:Y?'))
+        if mock_enabled:
+            # absolute, station services run from their own directories
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_data', '-5db.txt'),
+                      mode='rt', encoding='utf-8') as f:
+                mocked_raw_data = ast.literal_eval(''.join(f.readlines()))
 
-                raw_point = {
-                    'f_lo': freq_lo,
-                    'f_rf_label': freq_rf_label,
-                    'f_rf': freq_rf,
-                    'p_lo': pow_lo,
-                    'p_rf': pow_rf,
-                    'u_mul': src_u,
-                    'i_mul': i_mul_read,
-                    'pow_read': pow_read,
-                    'loss': p_loss,
-                }
+        self.eta.start(plan, self.timing, len(duts))
+        # a spec skip or abort leaves the rest of the plan unvisited, the timing model fits what was swept
+        self.visited_frequencies = 0
 
-                if mock_enabled:
-                    raw_point = mocked_raw_data[index]
-                    raw_point['loss'] = p_loss
-                    raw_point['f_rf_label'] = freq_rf_label
-                    index += 1
+        res = []
+        try:
+            for step in plan.frequencies:
+                self.visited_frequencies += 1
+                freq_lo = step.f_lo
+                freq_rf = step.f_rf
+                freq_rf_label = step.f_rf_label
+
+                gen_lo.send(f'SOUR:FREQ {freq_lo}GHz')
+
+                log_point.debug('delta LO: %s', step.delta_lo)
+                gen_lo.send(f'SOUR:POW {pow_lo + step.delta_lo}dbm')
+
+                gen_rf.send(f'SOUR:FREQ {freq_rf}GHz')
+
+                last_pow_read = None
+                for n, point in enumerate(step.points):
+
+                    token.check('measurement cancelled')
+
+                    log_point.debug('delta RF: %s', point.delta_rf)
+
+                    # with enough SNR on the previous reading the profile may widen RBW for speed
+                    settings = profile.settings(sa_span, noise_floor, last_pow_read)
+                    if settings != sa_settings:
+                        for command in profile.commands(settings):
+                            sa.send(command)
+                        sa_settings = settings
+
+                    # only readings close to the noise at the current RBW need the t-interval loop
+                    clean_level = profile.noise_level(sa_span, noise_floor, sa_settings) + profile.min_snr + self.avg_clean_margin
+                    averaging = (avg_target, avg_max, clean_level)
+
+                    with self.result.timer.measure(AcquisitionProfile.key(profile.name, sa_settings)):
+                        readings = self._run_point(token, point, sa_sync, traces is not None, averaging, duts)
+                    # the weakest DUT decides whether the profile can trade RBW for speed
+                    last_pow_read = min(r[1] for r in readings)
+
+                    for k, (dut, (i_mul_read, pow_read, trace, avg)) in enumerate(zip(duts, readings)):
+                        if traces is not None:
+                            traces.put(point.index * len(duts) + k, np.array(trace.split(','), dtype=np.float32),
+                                       freq_lo, freq_rf, point.p_rf, point.center_freq, sa_span, dut=dut or 1)
+
+                        raw_point = {
+                            'f_lo': freq_lo,
+                            'f_rf_label': freq_rf_label,
+                            'f_rf': freq_rf,
+                            'p_lo': pow_lo,
+                            'p_rf': point.p_rf,
+                            'u_mul': src_u,
+                            'i_mul': i_mul_read,
+                            'pow_read': pow_read,
+                            'loss': p_loss,
+                            'avg_n': avg.count,
+                            'avg_ci': round(avg.half_width, 3) if avg.count > 1 else None,
+                            'dut': dut or 1,
+                        }
+
+                        if mock_enabled:
+                            # grid sweeps outgrow the recorded dump, cycle through it
+                            raw_point = dict(mocked_raw_data[point.index % len(mocked_raw_data)])
+                            raw_point['loss'] = p_loss
+                            raw_point['f_rf_label'] = freq_rf_label
+                            raw_point['dut'] = dut or 1
+
+                        log_point.debug('%s', raw_point)
+                        self._add_measure_point(raw_point)
+
+                        res.append(raw_point)
+                    self.eta.point_done()
+                    if self.capture is not None:
+                        self.capture.flush()
+
+                    if self.result.failed_at(freq_rf_label):
+                        policy = secondary.get('spec_policy', 'continue')
+                        if policy == 'abort':
+                            raise SpecFailed(f'DUTs out of spec at {freq_rf_label} GHz')
+                        if policy == 'skip':
+                            log.warning('DUTs out of spec at %s GHz, skipping frequency', freq_rf_label)
+                            self.eta.skip(len(step.points) - n - 1)
+                            break
+        except SpecFailed as ex:
+            log.warning('sweep aborted: %s', ex)
+        except Exception:
+            # whatever stopped the sweep, the DUT is not left powered
+            try:
+                self._measure_teardown(pow_lo, pow_rf_start, freq_rf_start)
+            except Exception as ex:
+                log.error('teardown failed: %s', ex)
+            raise
+        finally:
+            if traces is not None:
+                traces.close()
+
+        if not mock_enabled and not self.replaying:
+            with open('out.txt', mode='wt', encoding='utf-8') as f:
+                f.write(str(res))
 
-                print(raw_point)
-                self._add_measure_point(raw_point)
+        self._measure_teardown(pow_lo, pow_rf_start, freq_rf_start)
+        return res
 
-                res.append(raw_point)
+    def _create_trace_store(self, sa, plan, dut_count=1):
+        trace_len = int(float(sa.query(':SENS:SWE:POIN?')))
+        make_dirs('traces')
+        self.trace_path = f'traces/trace-{now_timestamp()}.npy'
+        rows = plan.point_count * dut_count
+        log.info('capturing %s traces x %s points to %s', rows, trace_len, self.trace_path)
+        return TraceStore.create(self.trace_path, rows, trace_len)
+
+    def _run_point(self, token, point, sync, trace=False, averaging=(0.0, 1, None), duts=(None,)):
+        for attempt in range(self.point_retries + 1):
+            try:
+                return self.io.run(self._measure_point(point, sync, trace, averaging, duts), token=token)
+            except InstrumentReconnected as ex:
+                if attempt == self.point_retries:
+                    raise
+                log.warning('retrying point #%s %s dBm @ %s GHz: %s', point.index, point.p_rf, point.center_freq, ex)
+
+    async def _measure_point(self, point, sync, trace=False, averaging=(0.0, 1, None), duts=(None,)):
+        gen_lo = self._async_instruments['P LO']
+        gen_rf = self._async_instruments['P RF']
+        src = self._async_instruments['Источник']
+        mult = self._async_instruments['Мультиметр']
+        sa = self._async_instruments['Анализатор']
+        switch = self._async_instruments.get('Коммутатор')
+
+        async def set_generators():
+            await gen_rf.batch(*point.rf_commands)
+            await src.send('OUTPut ON')
+            await asyncio.gather(
+                gen_lo.send(f'OUTP:STAT ON'),
+                gen_rf.send(f'OUTP:STAT ON'),
+            )
+            if self._settling:
+                await asyncio.sleep(0.6)
+            elif mock_enabled:
+                await asyncio.sleep(0.1)
+
+        async def tune_analyzer():
+            await sa.batch(*point.sa_commands)
+
+        # analyzer retune does not depend on the generators, overlap it with their settling
+        await asyncio.gather(set_generators(), tune_analyzer())
+
+        async def read_current():
+            if mock_enabled:
+                return float(await mult.query('MEAS:CURR:DC? 1A,DEF'))
+            return float(await mult.query('FETC?'))
 
-        if not mock_enabled:
-            with open('out.txt', mode='wt', encoding='utf-8') as f:
-                f.write(str(res))
+        async def read_marker():
+            if not mock_enabled:
+                if sync:
+                    # *OPC? returns when the triggered sweep is complete, no guessed delay
+                    await sa.query('INIT:IMM;*OPC?')
+                elif self._settling:
+                    await asyncio.sleep(0.5)
+            return float(await sa.query(':CALCulate:MARKer:Y?'))
+
+        async def read_level():
+            # repeat sweeps only while the level is still too uncertain, time goes to the noisy points
+            target, max_count, clean_level = averaging
+            avg = LevelAverage(target, max_count=max_count, clean_level=clean_level)
+            avg.update(await read_marker())
+            while not avg.done:
+                avg.update(await read_marker())
+            # the full trace of the last sweep, parsed on the worker side
+            return avg, (await sa.query(':TRAC:DATA? TRACE1')) if trace else None
+
+        # generators settle once per state, the switch then walks through the DUTs at that state
+        readings = []
+        for dut in duts:
+            if dut is not None:
+                await switch.send(close_command(dut))
+                if self._settling:
+                    await asyncio.sleep(self.switch_settle)
+
+            # trigger the current reading as soon as the DUT has settled, fetch it while the analyzer sweeps
+            if not mock_enabled:
+                await mult.send('INIT')
+
+            i_mul_read, (avg, trace_data) = await asyncio.gather(read_current(), read_level())
+            readings.append((i_mul_read, avg.mean, trace_data, avg))
+        return readings
+
+    def _configure_multimeter(self, mult, secondary):
+        # fixed range and integration time once per run instead of autorange on every MEAS?
+        mult.send(f'CONF:CURR:DC {secondary.get("mult_range", 1.0)}')
+        mult.send(f'CURR:DC:NPLC {secondary.get("mult_nplc", 1.0)}')
+        mult.send(f'ZERO:AUTO {secondary.get("mult_autozero", "ONCE")}')
+        mult.send('TRIG:SOUR IMM')
+        mult.send('TRIG:DEL 0')
+        mult.send('SAMP:COUN 1')
+
+    def _measure_teardown(self, pow_lo, pow_rf_start, freq_rf_start):
+        gen_lo = self._instruments['P LO']
+        gen_rf = self._instruments['P RF']
+        src = self._instruments['Источник']
+        sa = self._instruments['Анализатор']
 
         gen_lo.send(f'OUTP:STAT OFF')
         gen_rf.send(f'OUTP:STAT OFF')
 
-        if not mock_enabled:
+        # RF off before supply off, not interruptible: this is the safe-state sequence itself
+        if self._settling:
             time.sleep(0.5)
 
         src.send('OUTPut OFF')
@@ -437,13 +828,42 @@ class InstrumentController(QObject):
         gen_lo.send(f'SOUR:FREQ {freq_rf_start}GHz')
 
         sa.send(':CAL:AUTO ON')
-        return res
+        sa.send('INIT:CONT ON')
+
+        # no DUT is left routed to the analyzer
+        switch = self._instruments.get('Коммутатор')
+        if switch:
+            switch.send('ROUT:OPEN:ALL')
+
+    @property
+    def _settling(self):
+        # settle delays are for real hardware, a replay is paced by the capture itself
+        return not mock_enabled and not self.replaying
+
+    def _sa_wait_sweep(self, sa, token, sync, delay, message):
+        if mock_enabled:
+            return
+        if not sync:
+            if self._settling:
+                token.sleep(delay, message)
+            return
+        token.check(message)
+        sa.query('INIT:IMM;*OPC?')
 
     def _add_measure_point(self, data):
-        print('measured point:', data)
+        log_point.debug('measured point: %s', data)
         self.result.add_point(data)
         self.pointReady.emit()
 
+    def close(self):
+        self._monitor.stop()
+        for inst in self._async_instruments.values():
+            inst.close()
+        self.io.stop()
+        if self.capture is not None:
+            self.capture.close()
+        self._rig_lock.release()
+
     def saveConfigs(self):
         pprint_to_file('params.ini', self.secondaryParams)
 
@@ -453,4 +873,14 @@ class InstrumentController(QObject):
 
     @property
     def status(self):
-        return [i.status for i in self._instruments.values()]
+        # an optional instrument that was not found keeps its place in the list
+        return [i.status if i else 'нет' for i in self._instruments.values()]
+
+
+def _trace_levels(trace, start, stop, freqs, window=2):
+    # peak level within +-window bins around each frequency, all frequencies at once
+    bins = np.linspace(start, stop, len(trace))
+    idx = np.searchsorted(bins, freqs)
+    offsets = np.arange(-window, window + 1)
+    neighbours = np.clip(idx[:, None] + offsets[None, :], 0, len(trace) - 1)
+    return trace[neighbours].max(axis=1)
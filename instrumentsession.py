@@ -0,0 +1,160 @@
+import logging
+import re
+import threading
+import time
+
+log = logging.getLogger('rig.session')
+
+
+class InstrumentError(RuntimeError):
+    pass
+
+
+class InstrumentReconnected(InstrumentError):
+    pass
+
+
+class InstrumentSession:
+    keepalive_query = '*IDN?'
+
+    def __init__(self, name, factory, instrument, retries=3, backoff=0.5):
+        self.name = name
+        self._factory = factory
+        self._instrument = instrument
+        self._retries = retries
+        self._backoff = backoff
+
+        self._lock = threading.RLock()
+        self._state = dict()
+        self.last_used = time.monotonic()
+        self.healthy = True
+        self.on_state_changed = None
+        # cancel token of the task using the session, a reconnect in progress gives up when it fires
+        self.token = None
+
+    def __getattr__(self, item):
+        return getattr(self._instrument, item)
+
+    def __bool__(self):
+        return bool(self._instrument)
+
+    def __str__(self):
+        return f'{self.name}: {self._instrument}'
+
+    def send(self, command):
+        with self._lock:
+            try:
+                res = self._call('send', command)
+            except InstrumentReconnected:
+                # setting commands are idempotent, re-issue on the fresh session
+                res = self._call('send', command)
+            self._remember(command)
+            return res
+
+    def query(self, question):
+        # a reading taken right after a reconnect is not trusted, the caller retries the whole point
+        with self._lock:
+            return self._call('query', question)
+
+    def ping(self):
+        with self._lock:
+            try:
+                self._call('query', self.keepalive_query, unrecorded=True)
+            except InstrumentReconnected:
+                pass
+
+    def _call(self, method, *args, unrecorded=False):
+        # keepalive traffic goes below the capture wrapper, it is not part of a recorded session
+        target = getattr(self._instrument, 'unrecorded', self._instrument) if unrecorded else self._instrument
+        try:
+            res = getattr(target, method)(*args)
+        except Exception as ex:
+            log.warning('%s: %s%s failed: %s', self.name, method, args, ex)
+            self._reconnect()
+            raise InstrumentReconnected(f'{self.name} reconnected after: {ex}') from ex
+        self.last_used = time.monotonic()
+        return res
+
+    def _reconnect(self):
+        self._set_healthy(False)
+        for attempt in range(1, self._retries + 1):
+            self._sleep(self._backoff * attempt)
+            try:
+                instrument = self._factory.find()
+                if not instrument:
+                    continue
+                self._instrument = instrument
+                self._replay()
+            except Exception as ex:
+                log.warning('%s: reconnect attempt %s failed: %s', self.name, attempt, ex)
+                continue
+            log.info('%s: reconnected on attempt %s', self.name, attempt)
+            self._set_healthy(True)
+            return
+        raise InstrumentError(f'{self.name}: lost connection to {self._factory.addr}')
+
+    def _sleep(self, seconds):
+        if self.token is None:
+            time.sleep(seconds)
+        else:
+            self.token.sleep(seconds, f'{self.name}: reconnect cancelled')
+
+    def _replay(self):
+        for command in self._state.values():
+            self._instrument.send(command)
+        self.last_used = time.monotonic()
+
+    def _remember(self, command):
+        header, *args = re.split(r'[\s,]+', command.strip())
+        header = header.lstrip(':').upper()
+        if header == '*RST':
+            self._state.clear()
+            return
+        if header.endswith('?') or header.startswith('*') or header in ('INIT', 'INIT:IMM', 'INIT:IMMEDIATE'):
+            return
+        # keep the latest value of each setting, in the order it was last applied;
+        # the first argument is part of the key, APPLY p6v and APPLY p25v are separate settings
+        key = (header, args[0].upper()) if len(args) > 1 else (header, )
+        self._state.pop(key, None)
+        self._state[key] = command
+
+    def _set_healthy(self, value):
+        if self.healthy == value:
+            return
+        self.healthy = value
+        if self.on_state_changed is not None:
+            self.on_state_changed(self.name, value)
+
+
+class SessionMonitor:
+
+    def __init__(self, sessions, interval=10.0):
+        self._sessions = sessions
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='session-keepalive', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=1)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self._interval / 2):
+            now = time.monotonic()
+            for session in list(self._sessions.values()):
+                if now - session.last_used < self._interval:
+                    continue
+                try:
+                    session.ping()
+                except RuntimeError as ex:
+                    log.error('keepalive failed: %s', ex)
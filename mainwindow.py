@@ -1,6 +1,6 @@
 import datetime
+import logging
 import os
-import time
 
 from subprocess import Popen
 
@@ -9,12 +9,17 @@ from PyQt5.QtGui import QGuiApplication
 from PyQt5.QtWidgets import QMainWindow
 from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot
 
+from forgot_again.file import make_dirs
+from forgot_again.string import now_timestamp
 from formlayout.formlayout import fedit
 from instrumentcontroller import InstrumentController
 from connectionwidget import ConnectionWidget
 from measurewidget import MeasureWidgetWithSecondaryParameters
+from postprocess import PostProcessor
 from primaryplotwidget import PrimaryPlotWidget
-from resulttablewidget import ResultTableWidget
+from resulttablewidget import ResultTableWidget, StatsTableWidget, PointsTableWidget
+from riglog import set_level
+from stallwatch import StackSampler, StallWatchdog
 
 
 class MainWindow(QMainWindow):
@@ -38,11 +43,21 @@ class MainWindow(QMainWindow):
         self._measureWidget = MeasureWidgetWithSecondaryParameters(parent=self, controller=self._instrumentController)
         self._plotWidget = PrimaryPlotWidget(parent=self, controller=self._instrumentController)
         self._tableResultWidget = ResultTableWidget(parent=self, controller=self._instrumentController)
+        self._statsWidget = StatsTableWidget(parent=self, controller=self._instrumentController)
+        self._pointsWidget = PointsTableWidget(parent=self, controller=self._instrumentController)
+
+        self._postprocessor = PostProcessor(parent=self)
+        self._processed = None
+
+        self._watchdog = StallWatchdog(parent=self)
+        self._profiler = StackSampler()
 
         # init UI
         self._ui.layInstrs.insertWidget(0, self._connectionWidget)
         self._ui.layInstrs.insertWidget(1, self._measureWidget)
 
+        self._ui.tabWidget.insertTab(0, self._pointsWidget, 'Все точки')
+        self._ui.tabWidget.insertTab(0, self._statsWidget, 'Статистика')
         self._ui.tabWidget.insertTab(0, self._tableResultWidget, 'Результат измерения')
         self._ui.tabWidget.insertTab(0, self._plotWidget, 'Прогресс измерения')
         self._ui.tabWidget.setCurrentIndex(0)
@@ -59,6 +74,14 @@ class MainWindow(QMainWindow):
         self._measureWidget.measureComplete.connect(self.on_measureComplete)
 
         self._instrumentController.pointReady.connect(self.on_point_ready)
+        self._instrumentController.io.taskFailed.connect(self.on_io_failed)
+
+        self._postprocessor.progress.connect(self._ui.statusbar.showMessage)
+        self._postprocessor.processed.connect(self.on_result_processed)
+        self._postprocessor.failed.connect(self.on_io_failed)
+
+        self._watchdog.stalled.connect(self.on_gui_stalled)
+        self._watchdog.start()
 
         self._measureWidget.updateWidgets(self._instrumentController.secondaryParams)
         self._measureWidget.on_params_changed(1)
@@ -88,10 +111,17 @@ class MainWindow(QMainWindow):
     @pyqtSlot()
     def on_measureComplete(self):
         print('meas complete')
-        self._instrumentController.result.process()
-        self._plotWidget.plot()
-        self._instrumentController.result.save_adjustment_template()
-        self._tableResultWidget.updateResult()
+        # processing, template save and tables run on the worker, the window stays responsive
+        self._postprocessor.submit(self._instrumentController.result)
+
+    @pyqtSlot(object)
+    def on_result_processed(self, processed):
+        self._processed = processed
+        logging.getLogger('rig.result').info(processed.timings)
+        self._ui.pteditProgress.appendPlainText('\n' + processed.timings)
+        self._plotWidget.plot(processed)
+        self._tableResultWidget.updateResult(processed.table)
+        self._ui.statusbar.showMessage('обработка завершена', 5000)
 
     @pyqtSlot()
     def on_measureStarted(self):
@@ -104,13 +134,14 @@ class MainWindow(QMainWindow):
             ('Калибровка', self._instrumentController.cal_set),
             ('Только основные', self._plotWidget.only_main_states),
             ('Набор для коррекции', [1, '+25', '+85', '-60']),
+            ('Подробный лог точек', logging.getLogger('rig.point').isEnabledFor(logging.DEBUG)),
         ]
 
         values = fedit(data=data, title='Параметры')
         if not values:
             return
 
-        adjust, cal_set, only_main_states, adjust_set = values
+        adjust, cal_set, only_main_states, adjust_set, point_log = values
 
         self._instrumentController.result.adjust = adjust
         self._instrumentController.result.adjust_set = adjust_set
@@ -118,21 +149,54 @@ class MainWindow(QMainWindow):
         self._instrumentController.only_main_states = only_main_states
         self._instrumentController.result.only_main_states = only_main_states
         self._plotWidget.only_main_states = only_main_states
+        set_level('rig.point', 'DEBUG' if point_log else 'WARNING')
+
+    @pyqtSlot(bool)
+    def on_actProfile_toggled(self, checked):
+        if checked:
+            self._profiler.start()
+            self._ui.statusbar.showMessage('профилирование запущено')
+            return
+        self._profiler.stop()
+        make_dirs('profile')
+        path = f'profile/profile-{now_timestamp()}.txt'
+        self._profiler.save(path)
+        self._ui.statusbar.showMessage(f'профиль сохранён: {path}', 10000)
+
+    @pyqtSlot(float)
+    def on_gui_stalled(self, duration):
+        self._ui.statusbar.showMessage(f'интерфейс не отвечал {duration:.2f} с, подробности в stalls.log', 5000)
 
     @pyqtSlot()
     def on_point_ready(self):
         self._ui.pteditProgress.setPlainText(self._instrumentController.result.report)
+        self._ui.statusbar.showMessage(self._instrumentController.eta.text)
         self._plotWidget.plot()
+        self._statsWidget.updateResult()
+        self._pointsWidget.updateResult()
+
+    @pyqtSlot(str)
+    def on_io_failed(self, message):
+        print('instrument io error:', message)
+        self._ui.statusbar.showMessage(message, 10000)
 
     def closeEvent(self, _):
+        self._watchdog.stop()
+        self._profiler.stop()
         self._instrumentController.saveConfigs()
+        self._connectionWidget.cancel()
         self._measureWidget.cancel()
-        while self._measureWidget._threads.activeThreadCount() > 0:
-            time.sleep(0.1)
+        self._connectionWidget.waitForDone()
+        self._measureWidget.waitForDone()
+        self._postprocessor.waitForDone()
+        self._instrumentController.close()
 
     @pyqtSlot()
     def on_btnExcel_clicked(self):
-        self._instrumentController.result.export_excel()
+        if self._processed is None:
+            self._ui.statusbar.showMessage('нет обработанного результата', 5000)
+            return
+        self._processed.source.export_excel()
 
     @pyqtSlot()
     def on_btnScreenShot_clicked(self):
@@ -1,12 +1,20 @@
 import sys
 
-from PyQt5.QtWidgets import QApplication
+from PyQt5.QtWidgets import QApplication, QMessageBox
 from mainwindow import MainWindow
+from riglock import RigBusy
+from riglog import setup_logging
 
 
 def main(args):
+    setup_logging()
     app = QApplication(args)
-    window = MainWindow()
+    try:
+        window = MainWindow()
+    except RigBusy as ex:
+        # the rig service (or another GUI) already drives these instruments
+        QMessageBox.critical(None, 'Стенд занят', str(ex))
+        sys.exit(1)
     window.show()
     sys.exit(app.exec_())
 
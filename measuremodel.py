@@ -1,4 +1,4 @@
-from PyQt5.QtCore import Qt, QAbstractTableModel, QVariant
+from PyQt5.QtCore import Qt, QAbstractTableModel, QVariant, QModelIndex
 
 
 class MeasureModel(QAbstractTableModel):
@@ -6,14 +6,77 @@ class MeasureModel(QAbstractTableModel):
         super().__init__(parent)
 
         self._header = list()
+        self._row_header = list()
         self._data = list()
 
-    def update(self, header, data):
+    def update(self, header, data, row_header=None):
+        row_header = list(row_header or [])
+        if header == self._header and row_header == self._row_header and len(data) == len(self._data):
+            # same shape, only values moved: repaint in place instead of resetting the view
+            self._data = data
+            if data and header:
+                self.dataChanged.emit(self.index(0, 0), self.index(len(data) - 1, len(header) - 1))
+            return
         self.beginResetModel()
         self._header = header
+        self._row_header = row_header
         self._data = data
         self.endResetModel()
 
+    def headerData(self, section, orientation, role=None):
+        if role != Qt.DisplayRole:
+            return QVariant()
+        if orientation == Qt.Horizontal:
+            if section < len(self._header):
+                return QVariant(self._header[section])
+        elif section < len(self._row_header):
+            return QVariant(self._row_header[section])
+        else:
+            return QVariant(section + 1)
+        return QVariant()
+
+    def rowCount(self, parent=None, *args, **kwargs):
+        if parent.isValid():
+            return 0
+        return len(self._data)
+
+    def columnCount(self, parent=None, *args, **kwargs):
+        return len(self._header)
+
+    def data(self, index, role=None):
+        if not index.isValid():
+            return QVariant()
+        if role == Qt.DisplayRole:
+            try:
+                return QVariant(self._data[index.row()][index.column()])
+            except LookupError:
+                return QVariant()
+        return QVariant()
+
+
+class PointsModel(QAbstractTableModel):
+    def __init__(self, parent=None, header=None, keys=None, source=None):
+        super().__init__(parent)
+
+        self._header = list(header or [])
+        self._keys = list(keys or [])
+        self._source = source if source is not None else list()
+        self._rows = 0
+
+    def sync(self):
+        count = len(self._source)
+        if count == self._rows:
+            return
+        if count < self._rows:
+            self.beginResetModel()
+            self._rows = count
+            self.endResetModel()
+            return
+        # only announce the new tail, views and proxies keep their state
+        self.beginInsertRows(QModelIndex(), self._rows, count - 1)
+        self._rows = count
+        self.endInsertRows()
+
     def headerData(self, section, orientation, role=None):
         if orientation == Qt.Horizontal:
             if role == Qt.DisplayRole:
@@ -22,19 +85,19 @@ class MeasureModel(QAbstractTableModel):
         return QVariant()
 
     def rowCount(self, parent=None, *args, **kwargs):
-        if parent.isValid():
+        if parent is not None and parent.isValid():
             return 0
-        return 1
+        return self._rows
 
     def columnCount(self, parent=None, *args, **kwargs):
-        return len(self._header)
+        return len(self._keys)
 
     def data(self, index, role=None):
         if not index.isValid():
             return QVariant()
         if role == Qt.DisplayRole:
             try:
-                return QVariant(self._data[index.column()])
+                return QVariant(self._source[index.row()][self._keys[index.column()]])
             except LookupError:
                 return QVariant()
         return QVariant()
@@ -1,15 +1,19 @@
+import copy
+import logging
 import os.path
-import random
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from subprocess import Popen
 from textwrap import dedent
+from types import MappingProxyType
 
-import openpyxl
 import pandas as pd
 
+from acquisitionprofile import PointTimer
 from forgot_again.file import load_ast_if_exists, pprint_to_file, make_dirs
 from forgot_again.string import now_timestamp
+from runningstats import RunningStats
+from speclimits import SpecLimits
 
 KHz = 1_000
 MHz = 1_000_000
@@ -17,6 +21,22 @@ GHz = 1_000_000_000
 mA = 1_000
 mV = 1_000
 
+log = logging.getLogger('rig.result')
+
+processed_columns = [
+    'Pгет, дБм', 'Fгет, ГГц',
+    'Pвх, дБм', 'Fвх, ГГц',
+    'Fпч, ГГц',
+    'Uпит, В', 'Iпит, мА',
+    'Pпч, дБм',
+    'Кп, дБм',
+    'Кривая',
+]
+
+# read-only outcome of post-processing, handed from the worker back to the GUI;
+# source is the detached MeasureResult it was built from, kept for export
+ProcessedResult = namedtuple('ProcessedResult', 'data data2 table timings source')
+
 
 class MeasureResult:
     def __init__(self):
@@ -26,21 +46,35 @@ class MeasureResult:
         self._report = dict()
         self._processed = list()
         self._processed_cutoffs = list()
+        self._label_freqs = dict()
+        self.cutoff_by_label = dict()
         self.ready = False
+        self.cutoff_level = -1
+
+        # switch matrix runs: this result holds DUT 1, the other DUTs get results of their own
+        self.dut = 1
+        self.others = dict()
+        self.last_raw = None
 
         self.data = defaultdict(list)
         self.data2 = dict()
+        self.stats = dict()
+        self.timer = PointTimer()
 
         self.adjustment = load_ast_if_exists('adjust.ini', default=None)
+        self.spec = SpecLimits()
         self._table_header = list()
-        self._table_data = list()
+        self._table_rows = list()
 
     def __bool__(self):
         return self.ready
 
     def process(self):
-        cutoff_level = -1
-        cutoffs = {1: []}
+        cutoff_level = self.cutoff_level
+        # LO x RF grid runs get one cutoff curve per LO frequency, others keep the single curve
+        grid = self.is_grid
+        cutoffs = defaultdict(list)
+        cutoff_by_label = dict()
 
         for f_rf, datas in self.data.items():
             reference = datas[0][1]
@@ -55,14 +89,51 @@ class MeasureResult:
                     break
             else:
                 cutoff_point = pow_in
-            cutoffs[1].append([f_rf, cutoff_point])
+            f_lo, f_rf_value = self._label_freqs.get(f_rf, (None, f_rf))
+            cutoffs[f_lo if grid else 1].append([f_rf_value, cutoff_point])
+            cutoff_by_label[f_rf] = cutoff_point
 
+        cutoffs = dict(cutoffs) or {1: []}
         self.data2 = cutoffs
         self._processed_cutoffs = cutoffs
+        self.cutoff_by_label = cutoff_by_label
+        self.spec.check_cutoffs(cutoff_by_label.items())
         self.ready = True
 
         self._prepare_table_data()
 
+        for other in self.others.values():
+            other.process()
+
+    def detach(self):
+        # copy of the containers the next run clears in place, the point dicts themselves are shared:
+        # a list of references per container, cheap enough for the GUI thread, unlike a deep copy of every point
+        other = copy.copy(self)
+        other._secondaryParams = dict(self._secondaryParams or {})
+        other._raw = list(self._raw)
+        other._report = dict(self._report)
+        other._processed = list(self._processed)
+        other._processed_cutoffs = copy.copy(self._processed_cutoffs)
+        other._label_freqs = dict(self._label_freqs)
+        other.cutoff_by_label = dict(self.cutoff_by_label)
+        other.others = {dut: result.detach() for dut, result in self.others.items()}
+        other.data = defaultdict(list, {k: list(v) for k, v in self.data.items()})
+        other.data2 = dict(self.data2)
+        other.stats = dict(self.stats)
+        other.timer = self.timer.copy()
+        # process() updates the cutoff verdicts in place
+        other.spec = copy.deepcopy(self.spec)
+        return other
+
+    def freeze(self):
+        return ProcessedResult(
+            data=MappingProxyType({k: tuple(map(tuple, v)) for k, v in self.data.items()}),
+            data2=MappingProxyType({k: tuple(map(tuple, v)) for k, v in self.data2.items()}),
+            table=self.get_result_table_data(),
+            timings=self.timer.report,
+            source=self,
+        )
+
     def _process_point(self, data):
         # region calc
         f_rf = data['f_rf']
@@ -94,10 +165,22 @@ class MeasureResult:
             'i_mul': round(data['i_mul'] * mA, 2),
             'p_pch': p_pch,
             'k_loss': round(k_loss, 2),
+            'f_rf_label': f_rf_label,
         }
 
         self.data[f_rf_label].append([p_rf, k_loss])
         self._processed.append({**self._report})
+        self._label_freqs.setdefault(f_rf_label, (f_lo, f_rf))
+
+        try:
+            self.stats[f_rf_label].update(k_loss, p_rf)
+        except KeyError:
+            self.stats[f_rf_label] = RunningStats()
+            self.stats[f_rf_label].update(k_loss, p_rf)
+
+        failed = self.spec.check_point(f_rf_label, self._report, self.stats[f_rf_label])
+        if failed:
+            log.warning('spec failed at %s GHz: %s', f_rf_label, [self.spec.header[c] for c in failed])
 
     def clear(self):
         self._secondaryParams.clear()
@@ -105,10 +188,17 @@ class MeasureResult:
         self._report.clear()
         self._processed.clear()
         self._processed_cutoffs.clear()
+        self._label_freqs.clear()
+        self.cutoff_by_label.clear()
+        self.others.clear()
+        self.last_raw = None
 
         self.data.clear()
+        self.stats.clear()
+        self.timer.clear()
 
         self.adjustment = load_ast_if_exists(self._primary_params.get('adjust', ''), default={})
+        self.spec = SpecLimits.from_table(self._primary_params.get('result', ''), compression=abs(self.cutoff_level))
 
         self.ready = False
 
@@ -119,12 +209,52 @@ class MeasureResult:
         self._primary_params = dict(**params)
 
     def add_point(self, data):
+        self.last_raw = data
+        dut = data.get('dut', 1)
+        if dut != self.dut:
+            self._for_dut(dut).add_point(data)
+            return
         self._raw.append(data)
         self._process_point(data)
 
+    def _for_dut(self, dut):
+        try:
+            return self.others[dut]
+        except KeyError:
+            pass
+        other = MeasureResult()
+        other.dut = dut
+        other.cutoff_level = self.cutoff_level
+        other.set_secondary_params(self._secondaryParams or {})
+        other.set_primary_params(self._primary_params or {})
+        other.clear()
+        self.others[dut] = other
+        return other
+
+    def by_dut(self):
+        return {self.dut: self, **self.others}
+
+    @property
+    def raw_points(self):
+        return list(self._raw)
+
+    @property
+    def point_count(self):
+        return len(self._raw)
+
+    @property
+    def is_grid(self):
+        # grid sweeps label curves 'f_rf/f_lo', plain sweeps use the float input frequency
+        return any(isinstance(label, str) for label in self._label_freqs)
+
+    @property
+    def processed(self):
+        # live list, appended to by the measurement thread; views index into it without copying
+        return self._processed
+
     def save_adjustment_template(self):
         if not self.adjustment:
-            print('measured, saving template')
+            log.info('measured, saving template')
             self.adjustment = [{
                 'p_lo': p['p_lo'],
                 'f_lo': p['f_lo'],
@@ -153,64 +283,56 @@ class MeasureResult:
         Расчётные параметры:
         Кп, дБм={k_loss}""".format(**self._report))
 
-    def export_excel(self):
-        device = 'demod'
+    def export_excel(self, reveal=True):
         path = 'xlsx'
 
         make_dirs(path)
 
+        if not self.others:
+            files = [self._export(path, 'demod')]
+        else:
+            files = [result._export(path, f'demod-dut{dut}') for dut, result in self.by_dut().items()]
+
+        if reveal:
+            full_path = os.path.abspath(files[-1])
+            Popen(f'explorer /select,"{full_path}"')
+        return files
+
+    def _export(self, path, device):
         file_name = f'./{path}/{device}-{now_timestamp()}.xlsx'
         df = pd.DataFrame(self._processed)
-
-        df.columns = [
-            'Pгет, дБм', 'Fгет, ГГц',
-            'Pвх, дБм', 'Fвх, ГГц',
-            'Fпч, ГГц',
-            'Uпит, В', 'Iпит, мА',
-            'Pпч, дБм',
-            'Кп, дБм'
-        ]
+        if not self.is_grid:
+            df = df.drop(columns='f_rf_label')
+        # grid curve labels 'f_rf/f_lo' are kept as text, rawdata reads them back
+        df.columns = processed_columns[:len(df.columns)]
         df.to_excel(file_name, engine='openpyxl', index=False)
 
         file_name = f'./{path}/{device}-cutoff-{now_timestamp()}.xlsx'
-        df = pd.DataFrame([{'f_lo': d[0], 'p_rf': d[1]} for d in self._processed_cutoffs[1]])
-
-        df.columns = ['Fгет., ГГц', 'Pвх.-1дБ, дБ']
+        if self.is_grid:
+            df = pd.DataFrame([{'f_lo': f_lo, 'f_rf': d[0], 'p_rf': d[1]}
+                               for f_lo, curve in self._processed_cutoffs.items() for d in curve])
+            df.columns = ['Fгет., ГГц', 'Fвх., ГГц', 'Pвх.-1дБ, дБ']
+        else:
+            df = pd.DataFrame([{'f_lo': d[0], 'p_rf': d[1]} for d in self._processed_cutoffs[1]])
+            df.columns = ['Fгет., ГГц', 'Pвх.-1дБ, дБ']
         df.to_excel(file_name, engine='openpyxl', index=False)
-
-        full_path = os.path.abspath(file_name)
-        Popen(f'explorer /select,"{full_path}"')
+        return file_name
 
     def _prepare_table_data(self):
-        table_file = self._primary_params.get('result', '')
-
-        if not os.path.isfile(table_file):
-            return
-
-        wb = openpyxl.load_workbook(table_file)
-        ws = wb.active
-
-        rows = list(ws.rows)
-        self._table_header = [row.value for row in rows[0][1:]]
-
-        gens = [
-            [rows[1][j].value, rows[2][j].value, rows[3][j].value]
-            for j in range(1, ws.max_column)
+        self._table_header, self._table_rows = self.spec.table()
+
+    def failed_at(self, freq):
+        # shared generator states are only worth skipping once every DUT has failed there
+        return self.spec.failed_at(freq) and all(o.failed_at(freq) for o in self.others.values())
+
+    def get_stats_table_data(self):
+        header = ['Fвх, ГГц', 'Точек', 'Кп.мс, дБ', 'Кп.мин, дБ', 'Кп.макс, дБ', 'Кп.ср, дБ', 'СКО, дБ', 'Сжатие, дБ']
+        rows = [
+            [f_rf, s.count, round(s.ss_gain, 2), round(s.min, 2), round(s.max, 2), round(s.mean, 2),
+             round(s.std, 3), round(s.compression, 2)]
+            for f_rf, s in list(self.stats.items())
         ]
-
-        self._table_data = [self._gen_value(col) for col in gens]
-
-    def _gen_value(self, data):
-        if not data:
-            return '-'
-        if '-' in data:
-            return '-'
-        span, step, mean = data
-        start = mean - span
-        stop = mean + span
-        if span == 0 or step == 0:
-            return mean
-        return round(random.randint(0, int((stop - start) / step)) * step + start, 2)
+        return header, rows
 
     def get_result_table_data(self):
-        return list(self._table_header), list(self._table_data)
+        return list(self._table_header), [list(r) for r in self._table_rows], ['Измерено', 'Норма', 'Результат']
@@ -1,9 +1,13 @@
 from PyQt5 import uic
 from PyQt5.QtCore import pyqtSlot, pyqtSignal, QRunnable, QThreadPool, QTimer
-from PyQt5.QtWidgets import QWidget, QDoubleSpinBox, QCheckBox
+from PyQt5.QtWidgets import QWidget, QDoubleSpinBox, QCheckBox, QComboBox, QLabel, QSpinBox
 
+from canceltoken import CancelToken
 from deviceselectwidget import DeviceSelectWidget
 from forgot_again.file import remove_if_exists
+from acquisitionprofile import profiles
+from speclimits import policies
+from sweepplan import sweep_modes
 
 
 class MeasureTask(QRunnable):
@@ -21,11 +25,6 @@ class MeasureTask(QRunnable):
         self.end()
 
 
-class CancelToken:
-    def __init__(self):
-        self.cancelled = False
-
-
 class MeasureWidget(QWidget):
 
     selectedChanged = pyqtSignal(str)
@@ -40,6 +39,7 @@ class MeasureWidget(QWidget):
         self._ui = uic.loadUi('measurewidget.ui', self)
         self._controller = controller
         self._threads = QThreadPool()
+        self._token = CancelToken()
 
         self._devices = DeviceSelectWidget(parent=self, params=self._controller.deviceParams)
         self._ui.layParams.insertWidget(0, self._devices)
@@ -50,8 +50,10 @@ class MeasureWidget(QWidget):
     def check(self):
         print('checking...')
         self._modeDuringCheck()
+        self._token = CancelToken()
         self._threads.start(MeasureTask(self._controller.check,
                                         self.checkTaskComplete,
+                                        self._token,
                                         self._selectedDevice))
 
     def checkTaskComplete(self):
@@ -75,12 +77,20 @@ class MeasureWidget(QWidget):
     def measure(self):
         print('measuring...')
         self._modeDuringMeasure()
+        self._token = CancelToken()
         self._threads.start(MeasureTask(self._controller.measure,
                                         self.measureTaskComplete,
+                                        self._token,
                                         self._selectedDevice))
 
     def cancel(self):
-        pass
+        if not self._token.cancelled:
+            if self._threads.activeThreadCount() > 0:
+                print('cancelling task')
+            self._token.cancel()
+
+    def waitForDone(self, msecs=-1):
+        return self._threads.waitForDone(msecs)
 
     def measureTaskComplete(self):
         if not self._controller.hasResult:
@@ -180,13 +190,12 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
     def __init__(self, parent=None, controller=None):
         super().__init__(parent=parent, controller=controller)
 
-        self._token = CancelToken()
-
         self._uiDebouncer = QTimer()
         self._uiDebouncer.setSingleShot(True)
         self._uiDebouncer.timeout.connect(self.on_debounced_gui)
 
         self._params = 0
+        self._multRange = 1.0
 
         # region LO params
         self._spinPlo = QDoubleSpinBox(parent=self)
@@ -278,6 +287,27 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
         self._spinFrfDelta.setValue(0.5)
         self._spinFrfDelta.setSuffix(' ГГц')
         self._devices._layout.addRow('ΔFвх.=', self._spinFrfDelta)
+
+        self._comboSweepMode = QComboBox(parent=self)
+        for key, label in sweep_modes.items():
+            self._comboSweepMode.addItem(label, key)
+        self._devices._layout.addRow('Перебор', self._comboSweepMode)
+
+        self._spinFif = QDoubleSpinBox(parent=self)
+        self._spinFif.setMinimum(0)
+        self._spinFif.setMaximum(40)
+        self._spinFif.setDecimals(3)
+        self._spinFif.setSingleStep(0.01)
+        self._spinFif.setValue(0)
+        self._spinFif.setSuffix(' ГГц')
+        self._spinFif.setSpecialValueText('по первой паре')
+        self._devices._layout.addRow('Fпч (пост. ПЧ)=', self._spinFif)
+
+        self._spinDutCount = QSpinBox(parent=self)
+        self._spinDutCount.setMinimum(1)
+        self._spinDutCount.setMaximum(16)
+        self._spinDutCount.setValue(1)
+        self._devices._layout.addRow('Кол-во DUT', self._spinDutCount)
         # endregion
 
         # region source params
@@ -298,6 +328,21 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
         self._devices._layout.addRow('Uпит.D=', self._spinUsrcD)
         # endregion
 
+        # region multimeter params
+        self._spinMultNplc = QDoubleSpinBox(parent=self)
+        self._spinMultNplc.setMinimum(0.02)
+        self._spinMultNplc.setMaximum(100)
+        self._spinMultNplc.setSingleStep(0.1)
+        self._spinMultNplc.setValue(1)
+        self._devices._layout.addRow('NPLC=', self._spinMultNplc)
+
+        self._comboMultAutozero = QComboBox(parent=self)
+        self._comboMultAutozero.addItem('однократно', 'ONCE')
+        self._comboMultAutozero.addItem('вкл', 'ON')
+        self._comboMultAutozero.addItem('выкл', 'OFF')
+        self._devices._layout.addRow('Автоноль', self._comboMultAutozero)
+        # endregion
+
         # region calc params
         self._spinLoss = QDoubleSpinBox(parent=self)
         self._spinLoss.setMinimum(0)
@@ -306,6 +351,11 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
         self._spinLoss.setValue(0.82)
         self._spinLoss.setSuffix(' дБ')
         self._devices._layout.addRow('Пбал.=', self._spinLoss)
+
+        self._comboSpecPolicy = QComboBox(parent=self)
+        for key, label in policies.items():
+            self._comboSpecPolicy.addItem(label, key)
+        self._devices._layout.addRow('Брак:', self._comboSpecPolicy)
         # endregion
 
         # region SA params
@@ -324,8 +374,53 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
         self._spinScaleY.setValue(5)
         self._spinScaleY.setSuffix(' дБ')
         self._devices._layout.addRow('Scale y=', self._spinScaleY)
+
+        self._comboSaProfile = QComboBox(parent=self)
+        for key, profile in profiles.items():
+            self._comboSaProfile.addItem(profile.label, key)
+        self._devices._layout.addRow('Профиль', self._comboSaProfile)
+
+        self._spinSaNoiseFloor = QDoubleSpinBox(parent=self)
+        self._spinSaNoiseFloor.setMinimum(-170)
+        self._spinSaNoiseFloor.setMaximum(0)
+        self._spinSaNoiseFloor.setSingleStep(1)
+        self._spinSaNoiseFloor.setValue(-100)
+        self._spinSaNoiseFloor.setSuffix(' дБм')
+        self._devices._layout.addRow('Шумы анализатора=', self._spinSaNoiseFloor)
+
+        self._checkSaSync = QCheckBox(parent=self)
+        self._checkSaSync.setChecked(True)
+        self._devices._layout.addRow('Одиночн. развёртка', self._checkSaSync)
+
+        self._checkSaTrace = QCheckBox(parent=self)
+        self._checkSaTrace.setChecked(False)
+        self._devices._layout.addRow('Трасса в каждой точке', self._checkSaTrace)
+
+        self._spinAvgTarget = QDoubleSpinBox(parent=self)
+        self._spinAvgTarget.setMinimum(0)
+        self._spinAvgTarget.setMaximum(3)
+        self._spinAvgTarget.setSingleStep(0.05)
+        self._spinAvgTarget.setValue(0)
+        self._spinAvgTarget.setPrefix('±')
+        self._spinAvgTarget.setSuffix(' дБ')
+        self._spinAvgTarget.setSpecialValueText('выкл.')
+        self._devices._layout.addRow('Точность Pпч=', self._spinAvgTarget)
+
+        self._spinAvgMax = QSpinBox(parent=self)
+        self._spinAvgMax.setMinimum(2)
+        self._spinAvgMax.setMaximum(100)
+        self._spinAvgMax.setValue(16)
+        self._devices._layout.addRow('Макс. отсчётов', self._spinAvgMax)
+
+        self._checkCalLoMaxhold = QCheckBox(parent=self)
+        self._checkCalLoMaxhold.setChecked(False)
+        self._devices._layout.addRow('Кал. Гет. max hold', self._checkCalLoMaxhold)
         # endregion
 
+        self._labelPlan = QLabel(parent=self)
+        self._labelPlan.setWordWrap(True)
+        self._devices._layout.addRow('План:', self._labelPlan)
+
     def _connectSignals(self):
         self._spinPlo.valueChanged.connect(self.on_params_changed)
         self._spinFloMin.valueChanged.connect(self.on_params_changed)
@@ -341,18 +436,33 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
         self._spinFrfMin.valueChanged.connect(self.on_params_changed)
         self._spinFrfMax.valueChanged.connect(self.on_params_changed)
         self._spinFrfDelta.valueChanged.connect(self.on_params_changed)
+        self._comboSweepMode.currentIndexChanged.connect(self.on_params_changed)
+        self._spinFif.valueChanged.connect(self.on_params_changed)
+        self._spinDutCount.valueChanged.connect(self.on_params_changed)
 
         self._spinUsrcA.valueChanged.connect(self.on_params_changed)
         self._spinUsrcD.valueChanged.connect(self.on_params_changed)
 
+        self._spinMultNplc.valueChanged.connect(self.on_params_changed)
+        self._comboMultAutozero.currentIndexChanged.connect(self.on_params_changed)
+
         self._spinLoss.valueChanged.connect(self.on_params_changed)
+        self._comboSpecPolicy.currentIndexChanged.connect(self.on_params_changed)
 
         self._spinRefLevel.valueChanged.connect(self.on_params_changed)
         self._spinScaleY.valueChanged.connect(self.on_params_changed)
+        self._comboSaProfile.currentIndexChanged.connect(self.on_params_changed)
+        self._spinSaNoiseFloor.valueChanged.connect(self.on_params_changed)
+        self._checkSaSync.toggled.connect(self.on_params_changed)
+        self._checkSaTrace.toggled.connect(self.on_params_changed)
+        self._spinAvgTarget.valueChanged.connect(self.on_params_changed)
+        self._spinAvgMax.valueChanged.connect(self.on_params_changed)
+        self._checkCalLoMaxhold.toggled.connect(self.on_params_changed)
 
     def check(self):
         print('subclass checking...')
         self._modeDuringCheck()
+        self._token = CancelToken()
         self._threads.start(
             MeasureTask(
                 self._controller.check,
@@ -361,20 +471,16 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
                 [self._selectedDevice, self._params]
             ))
 
-    def checkTaskComplete(self):
-        res = super(MeasureWidgetWithSecondaryParameters, self).checkTaskComplete()
-        if not res:
-            self._token = CancelToken()
-        return res
-
     def calibrate(self, what):
         print(f'calibrating {what}...')
         self._modeDuringMeasure()
+        self._token = CancelToken()
         self._threads.start(
             MeasureTask(
-                self._controller._calibrateLO if what == 'LO' else self._controller._calibrateRF,
+                self._controller.calibrate,
                 self.calibrateTaskComplete,
                 self._token,
+                what,
                 [self._selectedDevice, self._params]
             ))
 
@@ -386,6 +492,7 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
     def measure(self):
         print('subclass measuring...')
         self._modeDuringMeasure()
+        self._token = CancelToken()
         self._threads.start(
             MeasureTask(
                 self._controller.measure,
@@ -397,16 +504,9 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
     def measureTaskComplete(self):
         res = super(MeasureWidgetWithSecondaryParameters, self).measureTaskComplete()
         if not res:
-            self._token = CancelToken()
             self._modePreCheck()
         return res
 
-    def cancel(self):
-        if not self._token.cancelled:
-            if self._threads.activeThreadCount() > 0:
-                print('cancelling task')
-            self._token.cancelled = True
-
     def on_params_changed(self, value):
         if value != 1:
             self._uiDebouncer.start(5000)
@@ -424,13 +524,28 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
             'Frf_delta': self._spinFrfDelta.value(),
             'Frf_max': self._spinFrfMax.value(),
             'Frf_min': self._spinFrfMin.value(),
+            'sweep_mode': self._comboSweepMode.currentData(),
+            'f_if': self._spinFif.value(),
+            'dut_count': self._spinDutCount.value(),
             'Usrc': self._spinUsrcA.value(),
             'UsrcD': self._spinUsrcD.value(),
+            'mult_range': self._multRange,
+            'mult_nplc': self._spinMultNplc.value(),
+            'mult_autozero': self._comboMultAutozero.currentData(),
             'loss': self._spinLoss.value(),
             'ref_lev': self._spinRefLevel.value(),
             'scale_y': self._spinScaleY.value(),
+            'spec_policy': self._comboSpecPolicy.currentData(),
+            'sa_profile': self._comboSaProfile.currentData(),
+            'sa_noise_floor': self._spinSaNoiseFloor.value(),
+            'sa_sync': self._checkSaSync.isChecked(),
+            'sa_trace_capture': self._checkSaTrace.isChecked(),
+            'avg_target': self._spinAvgTarget.value(),
+            'avg_max': self._spinAvgMax.value(),
+            'cal_lo_maxhold': self._checkCalLoMaxhold.isChecked(),
         }
         self.secondaryChanged.emit(params)
+        self._labelPlan.setText(self._controller.plan_summary(params))
 
     def updateWidgets(self, params):
         self._spinPlo.setValue(params['Plo'])
@@ -445,11 +560,29 @@ class MeasureWidgetWithSecondaryParameters(MeasureWidget):
         self._spinFrfDelta.setValue(params['Frf_delta'])
         self._spinFrfMax.setValue(params['Frf_max'])
         self._spinFrfMin.setValue(params['Frf_min'])
+        self._comboSweepMode.setCurrentIndex(
+            max(self._comboSweepMode.findData(params.get('sweep_mode', 'zip')), 0))
+        self._spinFif.setValue(params.get('f_if', 0.0))
+        self._spinDutCount.setValue(params.get('dut_count', 1))
         self._spinUsrcA.setValue(params['Usrc'])
         self._spinUsrcD.setValue(params['UsrcD'])
+        self._multRange = params.get('mult_range', 1.0)
+        self._spinMultNplc.setValue(params.get('mult_nplc', 1.0))
+        self._comboMultAutozero.setCurrentIndex(
+            max(self._comboMultAutozero.findData(params.get('mult_autozero', 'ONCE')), 0))
         self._spinLoss.setValue(params['loss'])
         self._spinRefLevel.setValue(params['ref_lev'])
         self._spinScaleY.setValue(params['scale_y'])
+        self._spinSaNoiseFloor.setValue(params.get('sa_noise_floor', -100.0))
+        self._comboSaProfile.setCurrentIndex(
+            max(self._comboSaProfile.findData(params.get('sa_profile', 'normal')), 0))
+        self._checkSaSync.setChecked(params.get('sa_sync', True))
+        self._checkSaTrace.setChecked(params.get('sa_trace_capture', False))
+        self._spinAvgTarget.setValue(params.get('avg_target', 0.0))
+        self._spinAvgMax.setValue(params.get('avg_max', 16))
+        self._checkCalLoMaxhold.setChecked(params.get('cal_lo_maxhold', False))
+        self._comboSpecPolicy.setCurrentIndex(
+            max(self._comboSpecPolicy.findData(params.get('spec_policy', 'continue')), 0))
 
         self._connectSignals()
 
@@ -0,0 +1,85 @@
+import os.path
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from rawdata import load_raw_points, replay
+
+
+class LoadTask(QRunnable):
+
+    def __init__(self, fn, end, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.end = end
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        self.end(*self.args, self.fn(*self.args, **self.kwargs))
+
+
+class OverlayLoader(QObject):
+    loaded = pyqtSignal(str, object)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, parent=None, cache_size=16, max_points=200):
+        super().__init__(parent=parent)
+        self._threads = QThreadPool()
+        self._threads.setMaxThreadCount(2)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._cache_size = cache_size
+        self._max_points = max_points
+
+    def request(self, path):
+        key = self._key(path)
+        with self._lock:
+            curves = self._cache.get(key)
+            if curves is not None:
+                self._cache.move_to_end(key)
+        if curves is not None:
+            self.loaded.emit(path, curves)
+            return
+        self._threads.start(LoadTask(self._load, self._on_loaded, path))
+
+    def _key(self, path):
+        try:
+            return path, os.path.getmtime(path)
+        except OSError:
+            return path, None
+
+    def _load(self, path):
+        try:
+            # drawn with the run's own loss, a file that does not carry one is reported as failed
+            result = replay(load_raw_points(path, loss=None))
+        except Exception as ex:
+            return ex
+        # every DUT of a switch matrix dump is drawn, curves are keyed by (dut, label)
+        results = result.by_dut().items()
+        return {
+            'data': {(dut, k): _downsample(v, self._max_points) for dut, r in results for k, v in r.data.items()},
+            'data2': {(dut, k): _downsample(v, self._max_points) for dut, r in results for k, v in r.data2.items()},
+        }
+
+    def _on_loaded(self, path, curves):
+        # runs in the pool thread, the signal is queued to the GUI thread
+        if isinstance(curves, Exception):
+            self.failed.emit(path, str(curves))
+            return
+        with self._lock:
+            self._cache[self._key(path)] = curves
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        self.loaded.emit(path, curves)
+
+
+def _downsample(pairs, max_points):
+    if len(pairs) <= max_points:
+        return [tuple(p) for p in pairs]
+    idx = np.unique(np.linspace(0, len(pairs) - 1, max_points).round().astype(int))
+    return [tuple(pairs[i]) for i in idx]
@@ -0,0 +1,46 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class PostProcessTask(QRunnable):
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        self.fn(*self.args, **self.kwargs)
+
+
+class PostProcessor(QObject):
+    progress = pyqtSignal(str)
+    processed = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent=parent)
+        # one stage at a time, results come back in the order runs finished
+        self._threads = QThreadPool()
+        self._threads.setMaxThreadCount(1)
+
+    def submit(self, result):
+        # detached on the GUI thread, before the next run can clear the live result; only the containers
+        # are copied here, processing and the table work run on the pool thread
+        self._threads.start(PostProcessTask(self._run, result.detach()))
+
+    def _run(self, result):
+        try:
+            self.progress.emit('обработка результата...')
+            result.process()
+            self.progress.emit('сохранение шаблона корректировки...')
+            result.save_adjustment_template()
+            self.progress.emit('подготовка таблиц...')
+            processed = result.freeze()
+        except Exception as ex:
+            self.failed.emit(f'ошибка обработки: {type(ex).__name__}: {ex}')
+            return
+        self.processed.emit(processed)
+
+    def waitForDone(self, msecs=-1):
+        return self._threads.waitForDone(msecs)
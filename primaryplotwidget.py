@@ -1,14 +1,33 @@
+import os.path
+
+import numpy as np
 import pyqtgraph as pg
 
-from PyQt5.QtWidgets import QGridLayout, QWidget, QLabel
-from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QColor
+from PyQt5.QtWidgets import QGridLayout, QWidget, QLabel, QPushButton, QHBoxLayout, QFileDialog, QCheckBox
+from PyQt5.QtCore import Qt, pyqtSlot
+
+from overlayloader import OverlayLoader
 
 
 # https://www.learnpyqt.com/tutorials/plotting-pyqtgraph/
 # https://pyqtgraph.readthedocs.io/en/latest/introduction.html#what-is-pyqtgraph
 
-colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf',
-          '#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf',]
+colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+overlay_colors = ['#aec7e8', '#ffbb78', '#98df8a', '#ff9896', '#c5b0d5', '#c49c94', '#f7b6d2', '#c7c7c7', '#dbdb8d', '#9edae5']
+
+
+# above these the plot switches to the large dataset mode: no symbols, clip-to-view, peak downsampling
+dense_points = 2000
+symbol_points = 200
+
+
+def curve_color(index):
+    if index < len(colors):
+        return colors[index]
+    # golden ratio hue steps keep any number of extra curves distinguishable
+    hue = (index * 0.618033988749895) % 1.0
+    return QColor.fromHsvF(hue, 0.75, 0.8).name()
 
 
 class PrimaryPlotWidget(QWidget):
@@ -28,9 +47,28 @@ class PrimaryPlotWidget(QWidget):
         self._stat_label = QLabel('Mouse:')
         self._stat_label.setAlignment(Qt.AlignRight)
 
-        self._grid.addWidget(self._stat_label, 0, 0)
+        self._btnAddOverlay = QPushButton('Опорные прогоны...')
+        self._btnAddOverlay.clicked.connect(self.on_btnAddOverlay_clicked)
+        self._btnClearOverlays = QPushButton('Убрать опорные')
+        self._btnClearOverlays.clicked.connect(self.clear_overlays)
+
+        self._checkOpenGL = QCheckBox('OpenGL')
+        self._checkOpenGL.toggled.connect(self.on_checkOpenGL_toggled)
+
+        self._layTop = QHBoxLayout()
+        self._layTop.addWidget(self._btnAddOverlay)
+        self._layTop.addWidget(self._btnClearOverlays)
+        self._layTop.addWidget(self._checkOpenGL)
+        self._layTop.addWidget(self._stat_label, 1)
+
+        self._grid.addLayout(self._layTop, 0, 0)
         self._grid.addWidget(self._win, 1, 0)
 
+        self._overlays = dict()
+        self._overlayLoader = OverlayLoader(parent=self)
+        self._overlayLoader.loaded.connect(self.on_overlay_loaded)
+        self._overlayLoader.failed.connect(self.on_overlay_failed)
+
         self._plot_00 = self._win.addPlot(row=0, col=0)
         self._plot_01 = self._win.addPlot(row=1, col=0)
 
@@ -112,23 +150,71 @@ class PrimaryPlotWidget(QWidget):
         self._curves_00.clear()
         self._curves_01.clear()
 
-    def plot(self):
+    @pyqtSlot(bool)
+    def on_checkOpenGL_toggled(self, state):
+        try:
+            self._win.useOpenGL(state)
+        except Exception as ex:
+            print('OpenGL not available:', ex)
+            self._checkOpenGL.setChecked(False)
+
+    def add_overlay(self, path):
+        if path in self._overlays:
+            return
+        self._overlays[path] = []
+        self._overlayLoader.request(path)
+
+    def clear_overlays(self):
+        for items in self._overlays.values():
+            for plot, item in items:
+                plot.removeItem(item)
+        self._overlays.clear()
+
+    @pyqtSlot()
+    def on_btnAddOverlay_clicked(self):
+        paths, _ = QFileDialog.getOpenFileNames(
+            self, 'Опорные прогоны', 'xlsx', 'Измерения (*.xlsx *.txt);;Все файлы (*)')
+        for path in paths:
+            self.add_overlay(path)
+
+    @pyqtSlot(str, object)
+    def on_overlay_loaded(self, path, curves):
+        if path not in self._overlays:
+            return
+        color = overlay_colors[(list(self._overlays).index(path)) % len(overlay_colors)]
+        name = os.path.basename(path)
+        self._overlays[path] = (
+            _plot_overlay(curves['data'], self._plot_00, color, name) +
+            _plot_overlay(curves['data2'], self._plot_01, color, name)
+        )
+
+    @pyqtSlot(str, str)
+    def on_overlay_failed(self, path, message):
+        print(f'error loading overlay {path}:', message)
+        self._overlays.pop(path, None)
+
+    def plot(self, processed=None):
+        # live result while measuring, the frozen post-processed one once it arrives
+        source = processed or self._controller.result
         print('plotting primary stats')
-        _plot_curves(self._controller.result.data, self._curves_00, self._plot_00, prefix='Fвх=', suffix=' ГГц')
-        _plot_curves(self._controller.result.data2, self._curves_01, self._plot_01)
+        _plot_curves(source.data, self._curves_00, self._plot_00, prefix='Fвх=', suffix=' ГГц')
+        _plot_curves(source.data2, self._curves_01, self._plot_01)
 
 
 def _plot_curves(datas, curves, plot, prefix='', suffix=''):
-    for f_lo, data in datas.items():
+    datas = list(datas.items())
+    dense = sum(len(d) for _, d in datas) > dense_points
+
+    for f_lo, data in datas:
+        if not data:
+            continue
         curve_xs, curve_ys = zip(*data)
         try:
-            curves[f_lo].setData(x=curve_xs, y=curve_ys)
+            curve = curves[f_lo]
+            curve.setData(x=curve_xs, y=curve_ys)
         except KeyError:
-            try:
-                color = colors[len(curves)]
-            except IndexError:
-                color = colors[len(curves) - len(colors)]
-            curves[f_lo] = pg.PlotDataItem(
+            color = curve_color(len(curves))
+            curve = pg.PlotDataItem(
                 curve_xs,
                 curve_ys,
                 pen=pg.mkPen(
@@ -140,13 +226,50 @@ def _plot_curves(datas, curves, plot, prefix='', suffix=''):
                 symbolBrush=color,
                 name=f'{prefix}{f_lo}{suffix}'
             )
-            plot.addItem(curves[f_lo])
+            curve.large = False
+            curves[f_lo] = curve
+            plot.addItem(curve)
+
+        large = dense or len(data) > symbol_points
+        if large != curve.large:
+            _set_large_mode(curve, large)
+
+
+def _set_large_mode(curve, large):
+    curve.large = large
+    curve.setClipToView(large)
+    curve.setDownsampling(auto=large, method='peak')
+    if large:
+        curve.setSymbol(None)
+    else:
+        curve.setSymbol('o')
+
+
+def _plot_overlay(datas, plot, color, name):
+    items = []
+    for i, (_, data) in enumerate(datas.items()):
+        if not data:
+            continue
+        xs, ys = zip(*data)
+        item = pg.PlotDataItem(
+            xs,
+            ys,
+            pen=pg.mkPen(color=color, width=1, style=Qt.DashLine),
+            name=name if i == 0 else None,
+        )
+        plot.addItem(item)
+        items.append((plot, item))
+    return items
 
 
 def _label_text(x, y, vals):
-    vals_str = ''.join(f'   <span style="color:{colors[i]}">{f:0.1f}={v:0.2f}</span>' for i, (f, v) in enumerate(vals))
+    vals_str = ''.join(f'   <span style="color:{curve_color(i)}">{_format_label(f)}={v:0.2f}</span>' for i, (f, v) in enumerate(vals))
     return f"<span style='font-size: 8pt'>x={x:0.2f},   y={y:0.2f}   {vals_str}</span>"
 
 
-def _find_value_index(freqs: list, freq):
-    return min(range(len(freqs)), key=lambda i: abs(freqs[i] - freq))
+def _format_label(label):
+    return f'{label:0.1f}' if isinstance(label, (int, float)) else f'{label}'
+
+
+def _find_value_index(freqs, freq):
+    return int(np.argmin(np.abs(np.asarray(freqs) - freq)))
@@ -0,0 +1,81 @@
+import ast
+import os.path
+
+import pandas as pd
+
+from forgot_again.file import load_ast_if_exists
+from measureresult import MeasureResult, mA
+
+xlsx_columns = ['p_lo', 'f_lo', 'p_rf', 'f_rf', 'f_pch', 'u_mul', 'i_mul', 'p_pch', 'k_loss', 'f_rf_label']
+
+
+def is_raw_export(path):
+    name = os.path.basename(path)
+    return name.endswith('.xlsx') and '-cutoff-' not in name and not name.startswith('~$')
+
+
+def load_raw_points(path, loss=None):
+    # loss: overrides the value stored in the file, required for files that do not hold one
+    if path.endswith('.xlsx'):
+        points = _load_xlsx(path)
+    else:
+        points = _load_dump(path)
+
+    for p in points:
+        if loss is not None:
+            p['loss'] = loss
+        elif p.get('loss') is None:
+            raise ValueError(f'{path}: no loss in the file, give it explicitly')
+        p.setdefault('f_rf_label', float(p['f_rf']))
+    return points
+
+
+def _load_dump(path):
+    # out.txt / mock_data dumps: str() of the list of raw point dicts
+    with open(path, mode='rt', encoding='utf-8') as f:
+        return list(ast.literal_eval(f.read()))
+
+
+def _load_xlsx(path):
+    # exported tables hold processed values, restore the raw fields MeasureResult expects
+    df = pd.read_excel(path, engine='openpyxl')
+    df.columns = xlsx_columns[:len(df.columns)]
+    labels = 'f_rf_label' in df.columns
+    return [
+        {
+            **({'f_rf_label': str(row['f_rf_label'])} if labels else {}),
+            'f_lo': row['f_lo'],
+            'f_rf': row['f_rf'],
+            'p_lo': row['p_lo'],
+            'p_rf': row['p_rf'],
+            'u_mul': row['u_mul'],
+            'i_mul': row['i_mul'] / mA,
+            'pow_read': row['p_pch'],
+            'loss': _xlsx_loss(row),
+        }
+        for row in df.to_dict(orient='records')
+    ]
+
+
+def _xlsx_loss(row):
+    # Кп = Pпч - Pвх + Пбал, the table does not store the loss itself;
+    # any adjustment applied at export time is folded into it
+    k_loss = row.get('k_loss')
+    if k_loss is None or k_loss != k_loss:
+        return None
+    return round(k_loss - (row['p_pch'] - row['p_rf']), 2)
+
+
+def replay(points, loss=None, adjust=None, cutoff_level=-1):
+    result = MeasureResult()
+    result.set_primary_params({'adjust': adjust or '', 'result': ''})
+    result.set_secondary_params({'loss': loss})
+    result.adjustment = load_ast_if_exists(adjust, default=None) if adjust else None
+    result.cutoff_level = cutoff_level
+
+    for point in points:
+        if loss is not None:
+            point['loss'] = loss
+        result.add_point(point)
+    result.process()
+    return result
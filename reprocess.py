@@ -0,0 +1,85 @@
+import argparse
+import glob
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from forgot_again.file import make_dirs
+from forgot_again.string import now_timestamp
+from rawdata import load_raw_points, is_raw_export, replay
+
+
+def reprocess_file(path, adjust, loss, cutoff_level):
+    result = replay(load_raw_points(path, loss=loss), loss=loss, adjust=adjust, cutoff_level=cutoff_level)
+
+    # switch matrix dumps hold several DUTs, each one gets its own rows
+    return [
+        {
+            'file': os.path.basename(path),
+            'dut': dut,
+            'f_rf': f_rf,
+            'points': len(pairs),
+            'k_loss_ss': pairs[0][1],
+            'k_loss_max': max(k for _, k in pairs),
+            'k_loss_min': min(k for _, k in pairs),
+            'p_in_cutoff': dut_result.cutoff_by_label.get(f_rf),
+        }
+        for dut, dut_result in result.by_dut().items()
+        for f_rf, pairs in dut_result.data.items()
+    ]
+
+
+def collect_files(patterns):
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        files.extend(f for f in matches if not f.endswith('.xlsx') or is_raw_export(f))
+    return files
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Пакетная переобработка архивных измерений')
+    parser.add_argument('files', nargs='+', help='xlsx/demod-*.xlsx, out.txt, ...')
+    parser.add_argument('--adjust', default=None, help='файл корректировки (adjust_*.ini)')
+    parser.add_argument('--loss', type=float, default=None, help='Пбал., дБ (по умолчанию из файла, для xlsx по Кп и Pпч)')
+    parser.add_argument('--cutoff', type=float, default=-1, help='уровень компрессии, дБ')
+    parser.add_argument('--jobs', type=int, default=None, help='число процессов')
+    parser.add_argument('--out', default=None, help='итоговая таблица')
+    opts = parser.parse_args(args)
+
+    files = collect_files(opts.files)
+    print(f'reprocessing {len(files)} runs')
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=opts.jobs) as pool:
+        futures = {
+            pool.submit(reprocess_file, f, opts.adjust, opts.loss, opts.cutoff): f
+            for f in files
+        }
+        for future in as_completed(futures):
+            try:
+                rows.extend(future.result())
+            except Exception as ex:
+                print(f'error processing {futures[future]}:', ex)
+
+    if not rows:
+        print('nothing processed')
+        return 1
+
+    out = opts.out
+    if out is None:
+        make_dirs('xlsx')
+        out = f'./xlsx/reprocess-{now_timestamp()}.xlsx'
+
+    df = pd.DataFrame(rows).sort_values(['file', 'dut', 'f_rf'])
+    df.columns = ['Файл', 'DUT', 'Fвх, ГГц', 'Точек', 'Кп.мс, дБ', 'Кп.макс, дБ', 'Кп.мин, дБ', f'Pвх.{opts.cutoff}дБ, дБм']
+    df.to_excel(out, engine='openpyxl', index=False)
+    print('summary saved to', out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,143 @@
+import datetime
+import hashlib
+import json
+import sqlite3
+
+from contextlib import contextmanager
+
+import numpy as np
+
+point_fields = ['f_lo', 'f_rf_label', 'f_rf', 'p_lo', 'p_rf', 'u_mul', 'i_mul', 'pow_read', 'loss', 'avg_n', 'avg_ci']
+
+_schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device TEXT NOT NULL,
+    corner TEXT NOT NULL,
+    param_hash TEXT NOT NULL,
+    calibration_id TEXT NOT NULL,
+    created TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    params TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_runs_lookup ON runs (device, corner, param_hash, created);
+CREATE INDEX IF NOT EXISTS ix_runs_calibration ON runs (calibration_id, created);
+CREATE INDEX IF NOT EXISTS ix_runs_created ON runs (created);
+CREATE TABLE IF NOT EXISTS run_data (
+    run_id INTEGER PRIMARY KEY REFERENCES runs (id) ON DELETE CASCADE,
+    fields TEXT NOT NULL,
+    data BLOB NOT NULL,
+    labels TEXT
+);
+"""
+
+
+def stable_hash(obj):
+    # repr of sorted items, so dict ordering and float formatting in .ini files do not matter
+    def _norm(o):
+        if isinstance(o, dict):
+            return tuple(sorted((str(k), _norm(v)) for k, v in o.items()))
+        if isinstance(o, (list, tuple)):
+            return tuple(_norm(v) for v in o)
+        if isinstance(o, float):
+            return round(o, 6)
+        return o
+    return hashlib.sha1(repr(_norm(obj)).encode('utf-8')).hexdigest()[:16]
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def calibration_id(cal_lo, cal_rf):
+    if not cal_lo and not cal_rf:
+        return 'none'
+    return stable_hash([cal_lo or {}, cal_rf or {}])
+
+
+class ResultArchive:
+
+    def __init__(self, path='archive.db'):
+        self._path = path
+        with self._connect() as con:
+            con.executescript(_schema)
+            # archives created before curve labels were stored
+            if 'labels' not in {row['name'] for row in con.execute('PRAGMA table_info(run_data)')}:
+                con.execute('ALTER TABLE run_data ADD COLUMN labels TEXT')
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self._path)
+        con.row_factory = sqlite3.Row
+        con.execute('PRAGMA foreign_keys = ON')
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def store(self, raw_points, device, corner, params, calibration, created=None):
+        created = created or datetime.datetime.now().isoformat(timespec='seconds')
+        data = np.array([[_as_float(p.get(f)) for f in point_fields] for p in raw_points], dtype=np.float64)
+        # grid curve labels 'f_rf/f_lo' are not numbers, kept as text next to the float block
+        labels = [p.get('f_rf_label') for p in raw_points]
+        labels = json.dumps(labels) if any(isinstance(label, str) for label in labels) else None
+
+        with self._connect() as con:
+            cur = con.execute(
+                'INSERT INTO runs (device, corner, param_hash, calibration_id, created, points, params) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (device, corner, stable_hash(params), calibration, created, len(raw_points), repr(params))
+            )
+            run_id = cur.lastrowid
+            con.execute(
+                'INSERT INTO run_data (run_id, fields, data, labels) VALUES (?, ?, ?, ?)',
+                (run_id, ','.join(point_fields), data.tobytes(), labels)
+            )
+        return run_id
+
+    def find(self, device=None, corner=None, param_hash=None, calibration=None, since=None, until=None, limit=100):
+        where, args = [], []
+        for column, value in [('device', device), ('corner', corner),
+                              ('param_hash', param_hash), ('calibration_id', calibration)]:
+            if value is not None:
+                where.append(f'{column} = ?')
+                args.append(value)
+        if since is not None:
+            where.append('created >= ?')
+            args.append(since)
+        if until is not None:
+            where.append('created < ?')
+            args.append(until)
+
+        sql = 'SELECT id, device, corner, param_hash, calibration_id, created, points FROM runs'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY created DESC LIMIT ?'
+        args.append(limit)
+
+        with self._connect() as con:
+            return [dict(row) for row in con.execute(sql, args)]
+
+    def load(self, run_id):
+        with self._connect() as con:
+            row = con.execute('SELECT fields, data, labels FROM run_data WHERE run_id = ?', (run_id,)).fetchone()
+        if row is None:
+            raise LookupError(f'no run {run_id} in archive')
+        fields = row['fields'].split(',')
+        data = np.frombuffer(row['data'], dtype=np.float64).reshape(-1, len(fields))
+        points = [dict(zip(fields, (float(v) for v in values))) for values in data]
+        if row['labels']:
+            for point, label in zip(points, json.loads(row['labels'])):
+                point['f_rf_label'] = label
+        return points
+
+    def params(self, run_id):
+        with self._connect() as con:
+            row = con.execute('SELECT params FROM runs WHERE id = ?', (run_id,)).fetchone()
+        if row is None:
+            raise LookupError(f'no run {run_id} in archive')
+        return row['params']
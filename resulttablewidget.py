@@ -1,6 +1,8 @@
-from PyQt5.QtWidgets import QTableView, QWidget, QVBoxLayout
+from PyQt5.QtCore import QSortFilterProxyModel, Qt
+from PyQt5.QtWidgets import QTableView, QWidget, QVBoxLayout, QLineEdit, QHeaderView
 
-from measuremodel import MeasureModel
+from measuremodel import MeasureModel, PointsModel
+from measureresult import processed_columns
 
 
 class ResultTableWidget(QWidget):
@@ -19,5 +21,59 @@ class ResultTableWidget(QWidget):
 
         self._result = controller.result
 
+    def updateResult(self, table=None):
+        self._model.update(*(table or self._result.get_result_table_data()))
+
+
+class StatsTableWidget(QWidget):
+
+    def __init__(self, parent=None, controller=None):
+        super().__init__(parent=parent)
+
+        self._model = MeasureModel(parent=self)
+        self._table = QTableView()
+        self._table.setModel(self._model)
+
+        self._layout = QVBoxLayout()
+        self._layout.addWidget(self._table)
+
+        self.setLayout(self._layout)
+
+        self._result = controller.result
+
+    def updateResult(self):
+        self._model.update(*self._result.get_stats_table_data())
+
+
+class PointsTableWidget(QWidget):
+    keys = ['p_lo', 'f_lo', 'p_rf', 'f_rf', 'f_pch', 'u_mul', 'i_mul', 'p_pch', 'k_loss']
+
+    def __init__(self, parent=None, controller=None):
+        super().__init__(parent=parent)
+
+        self._result = controller.result
+
+        self._model = PointsModel(parent=self, header=processed_columns, keys=self.keys, source=self._result.processed)
+        self._proxy = QSortFilterProxyModel(parent=self)
+        self._proxy.setSourceModel(self._model)
+        self._proxy.setFilterKeyColumn(-1)
+        self._proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+
+        self._filter = QLineEdit()
+        self._filter.setPlaceholderText('Фильтр...')
+        self._filter.textChanged.connect(self._proxy.setFilterFixedString)
+
+        self._table = QTableView()
+        self._table.setModel(self._proxy)
+        self._table.setSortingEnabled(True)
+        self._table.sortByColumn(-1, Qt.AscendingOrder)
+        self._table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+
+        self._layout = QVBoxLayout()
+        self._layout.addWidget(self._filter)
+        self._layout.addWidget(self._table)
+
+        self.setLayout(self._layout)
+
     def updateResult(self):
-        self._model.update(*self._result.get_result_table_data())
+        self._model.sync()
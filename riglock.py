@@ -0,0 +1,65 @@
+import os
+import sys
+
+
+class RigBusy(RuntimeError):
+    pass
+
+
+class RigLock:
+    # one controller per instr.ini: the GUI and the rig service would otherwise drive the same addresses;
+    # the OS drops the lock with the process, a crashed run never leaves a stale one behind
+
+    def __init__(self, path='instr.ini.lock'):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        f = open(self.path, mode='a+', encoding='utf-8')
+        try:
+            _lock(f)
+        except OSError:
+            holder = _holder(f)
+            f.close()
+            raise RigBusy(f'rig is in use by {holder} ({os.path.abspath(self.path)})')
+        f.seek(0)
+        f.truncate()
+        f.write(f'pid {os.getpid()}: {os.path.basename(sys.argv[0])}')
+        f.flush()
+        self._file = f
+
+    def release(self):
+        if self._file is None:
+            return
+        _unlock(self._file)
+        self._file.close()
+        self._file = None
+
+
+def _holder(f):
+    try:
+        f.seek(0)
+        return f.read().strip() or 'another process'
+    except OSError:
+        # the locked byte is not readable on Windows
+        return 'another process'
+
+
+if sys.platform == 'win32':
+    import msvcrt
+
+    def _lock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+    def _unlock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,65 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+
+from forgot_again.file import load_ast_if_exists
+
+# subsystem loggers, children of 'rig':
+#   rig.measure, rig.calibrate -- run progress
+#   rig.point                  -- per-point detail, off unless DEBUG
+#   rig.session                -- instrument connection health
+#   rig.result                 -- processing and export
+default_levels = {
+    'rig': 'INFO',
+    'rig.point': 'WARNING',
+}
+
+_listener = None
+
+
+def setup_logging(path='logging.ini', filename=None):
+    # records are queued by the measurement thread and written by the listener thread,
+    # a slow console never stalls a sweep
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = logging.Formatter('%(asctime)s %(levelname)-7s %(name)s: %(message)s')
+    handlers = [logging.StreamHandler()]
+    if filename:
+        handlers.append(logging.FileHandler(filename, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, *handlers)
+    _listener.start()
+
+    root = logging.getLogger('rig')
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.propagate = False
+
+    for name, level in load_ast_if_exists(path, default=default_levels).items():
+        set_level(name, level)
+
+    atexit.register(stop_logging)
+
+
+def set_level(name, level):
+    logger = logging.getLogger(name)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    return logging.getLevelName(logger.level)
+
+
+def levels():
+    names = ['rig'] + [n for n in logging.root.manager.loggerDict if n.startswith('rig.')]
+    return {n: logging.getLevelName(logging.getLogger(n).getEffectiveLevel()) for n in sorted(names)}
+
+
+def stop_logging():
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
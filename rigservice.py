@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import Qt
+
+from canceltoken import CancelToken
+from riglock import RigBusy
+from riglog import setup_logging, set_level, levels
+
+# newline-delimited JSON over a local socket:
+#   request  {"id": 1, "cmd": "measure", "args": {"device": "+25"}}
+#   reply    {"id": 1, "ok": true, "result": ...} or {"id": 1, "ok": false, "error": "..."}
+#   event    {"event": "point", "data": {...}}, pushed to subscribed clients only
+default_port = 6025
+commands = ('connect', 'check', 'calibrate', 'measure', 'cancel', 'params', 'status', 'log', 'subscribe')
+
+
+def _jsonable(value):
+    # numpy scalars and anything else json does not know about
+    try:
+        return value.item()
+    except AttributeError:
+        return str(value)
+
+
+def _encode(message):
+    return (json.dumps(message, ensure_ascii=False, default=_jsonable) + '\n').encode('utf-8')
+
+
+class RigService:
+
+    def __init__(self, controller, queue_size=1000):
+        self._controller = controller
+        self._queue_size = queue_size
+        # one task at a time, the rig has one set of instruments
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._loop = None
+        self._subscribers = set()
+        self._token = CancelToken()
+        self._busy = None
+        self._report = None
+
+        controller.pointReady.connect(self._on_point, type=Qt.DirectConnection)
+        controller.instrumentStateChanged.connect(self._on_instrument, type=Qt.DirectConnection)
+
+    async def serve(self, host='127.0.0.1', port=default_port, path=None):
+        self._loop = asyncio.get_running_loop()
+        if path:
+            server = await asyncio.start_unix_server(self._handle, path=path)
+        else:
+            server = await asyncio.start_server(self._handle, host=host, port=port)
+        print('rig service listening on', ', '.join(str(s.getsockname()) for s in server.sockets))
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        queue = asyncio.Queue(maxsize=self._queue_size)
+        sender = asyncio.ensure_future(self._send_loop(queue, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self._put(queue, await self._dispatch(line, queue))
+        finally:
+            self._subscribers.discard(queue)
+            sender.cancel()
+            writer.close()
+
+    async def _send_loop(self, queue, writer):
+        while True:
+            writer.write(_encode(await queue.get()))
+            await writer.drain()
+
+    def _put(self, queue, message):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # a stalled client loses events, the measurement never waits for it
+            pass
+
+    async def _dispatch(self, line, queue):
+        try:
+            request = json.loads(line)
+            cmd = request['cmd']
+            args = request.get('args', {})
+        except (ValueError, KeyError, TypeError) as ex:
+            return {'id': None, 'ok': False, 'error': f'bad request: {ex}'}
+
+        req_id = request.get('id')
+        if cmd not in commands:
+            return {'id': req_id, 'ok': False, 'error': f'unknown command {cmd}'}
+        try:
+            if cmd == 'subscribe':
+                self._subscribers.add(queue)
+                result = True
+            else:
+                result = await getattr(self, f'_cmd_{cmd}')(**args)
+        except (TypeError, KeyError, RuntimeError) as ex:
+            return {'id': req_id, 'ok': False, 'error': f'{type(ex).__name__}: {ex}'}
+        return {'id': req_id, 'ok': True, 'result': result}
+
+    def _broadcast(self, message):
+        for queue in list(self._subscribers):
+            self._put(queue, message)
+
+    def _emit(self, message):
+        # called from the worker thread
+        self._loop.call_soon_threadsafe(self._broadcast, message)
+
+    def _start(self, name, fn, *args):
+        if self._busy is not None:
+            raise RuntimeError(f'busy: {self._busy}')
+        self._busy = name
+        self._token = CancelToken()
+        future = self._loop.run_in_executor(self._executor, fn, self._token, *args)
+        future.add_done_callback(lambda f: self._on_task_done(name, f))
+        self._broadcast({'event': 'started', 'task': name})
+        return name
+
+    def _on_task_done(self, name, future):
+        self._busy = None
+        ex = None if future.cancelled() else future.exception()
+        self._broadcast({
+            'event': 'done',
+            'task': name,
+            'ok': ex is None and not self._token.cancelled,
+            'error': f'{type(ex).__name__}: {ex}' if ex is not None else None,
+            'status': self._status(),
+        })
+
+    def _status(self):
+        ctrl = self._controller
+        return {
+            'busy': self._busy,
+            'found': ctrl.found,
+            'present': ctrl.present,
+            'has_result': ctrl.hasResult,
+            'points': ctrl.result.point_count,
+            'report': self._report,
+        }
+
+    async def _cmd_connect(self, addrs=None):
+        return self._start('connect', lambda token: self._controller.connect(addrs or {}, token))
+
+    async def _cmd_check(self, device):
+        return self._start('check', self._controller.check, [device, self._controller.secondaryParams])
+
+    async def _cmd_calibrate(self, what):
+        return self._start(f'calibrate {what}', self._controller.calibrate, what, self._controller.secondaryParams)
+
+    async def _cmd_measure(self, device):
+        return self._start('measure', self._measure, device)
+
+    def _measure(self, token, device):
+        ctrl = self._controller
+        self._report = None
+        ctrl.measure(token, [device, ctrl.secondaryParams])
+        if not ctrl.hasResult or token.cancelled:
+            return
+        # what the GUI does once a run completes: process, keep the adjustment template, export the tables
+        ctrl.result.process()
+        ctrl.result.save_adjustment_template()
+        self._report = ctrl.result.export_excel(reveal=False)
+
+    async def _cmd_cancel(self):
+        self._token.cancel()
+        return self._busy
+
+    async def _cmd_params(self, **params):
+        if params:
+            if self._busy is not None:
+                raise RuntimeError(f'busy: {self._busy}')
+            self._controller.on_secondary_changed(dict(self._controller.secondaryParams, **params))
+        return self._controller.secondaryParams
+
+    async def _cmd_status(self):
+        return self._status()
+
+    async def _cmd_log(self, **loggers):
+        # e.g. {"rig.point": "DEBUG"} turns on per-point detail in a running service
+        for name, level in loggers.items():
+            set_level(name, level)
+        return levels()
+
+    def _on_point(self):
+        # the point just added, of whichever DUT; copying the whole point list per point would be quadratic
+        self._emit({'event': 'point', 'data': self._controller.result.last_raw})
+
+    def _on_instrument(self, name, healthy):
+        self._emit({'event': 'instrument', 'name': name, 'healthy': healthy})
+
+    def close(self):
+        self._token.cancel()
+        self._executor.shutdown(wait=True)
+        self._controller.close()
+
+
+class RigClient:
+
+    def __init__(self, host='127.0.0.1', port=default_port, path=None, timeout=None):
+        if path:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(path)
+        else:
+            self._sock = socket.create_connection((host, port))
+        self._sock.settimeout(timeout)
+        self._file = self._sock.makefile('rwb')
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._replies = {}
+        self._events = []
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+    def request(self, cmd, **args):
+        with self._lock:
+            self._next_id += 1
+            req_id = self._next_id
+            self._file.write(_encode({'id': req_id, 'cmd': cmd, 'args': args}))
+            self._file.flush()
+            while req_id not in self._replies:
+                self._read()
+            reply = self._replies.pop(req_id)
+        if not reply['ok']:
+            raise RuntimeError(reply['error'])
+        return reply['result']
+
+    def events(self):
+        # blocks waiting for pushed events, replies to other requests are kept for request()
+        while True:
+            with self._lock:
+                if not self._events:
+                    self._read()
+                if self._events:
+                    yield self._events.pop(0)
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('rig service closed the connection')
+        message = json.loads(line)
+        if 'event' in message:
+            self._events.append(message)
+        else:
+            self._replies[message.get('id')] = message
+
+
+def serve(args):
+    from instrumentcontroller import InstrumentController
+
+    setup_logging()
+    try:
+        controller = InstrumentController()
+    except RigBusy as ex:
+        print(ex)
+        return 1
+    if args.tables:
+        # spec tables and adjustment files shared by several stations, each running in its own directory
+        controller.deviceParams = {
+            corner: {k: os.path.join(args.tables, v) for k, v in files.items()}
+            for corner, files in controller.deviceParams.items()
+        }
+    if args.replay:
+        controller.replay(args.replay, speed=args.speed)
+    elif args.record:
+        controller.record(args.record)
+
+    service = RigService(controller)
+    try:
+        asyncio.run(service.serve(host=args.host, port=args.port, path=args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+def call(args):
+    client = RigClient(host=args.host, port=args.port, path=args.unix)
+    try:
+        params = dict(p.split('=', 1) for p in args.args)
+        if args.cmd == 'params':
+            params = {k: json.loads(v) for k, v in params.items()}
+        print(json.dumps(client.request(args.cmd, **params), ensure_ascii=False, indent=2))
+    finally:
+        client.close()
+
+
+def watch(args):
+    client = RigClient(host=args.host, port=args.port, path=args.unix)
+    try:
+        client.request('subscribe')
+        for event in client.events():
+            print(json.dumps(event, ensure_ascii=False))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Сервис управления стендом')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--unix', default=None, help='путь к unix-сокету вместо TCP')
+    sub = parser.add_subparsers(dest='mode', required=True)
+
+    p = sub.add_parser('serve', help='запустить сервис')
+    p.add_argument('--record', default=None, help='записать обмен с приборами в файл (.scpi.gz)')
+    p.add_argument('--replay', default=None, help='воспроизвести записанный обмен вместо стенда')
+    p.add_argument('--speed', type=float, default=None, help='темп воспроизведения, 1.0 - как при записи')
+    p.add_argument('--tables', default=None, help='каталог с таблицами норм и файлами корректировки')
+    p.set_defaults(fn=serve)
+
+    p = sub.add_parser('call', help='выполнить команду')
+    p.add_argument('cmd', choices=[c for c in commands if c != 'subscribe'])
+    p.add_argument('args', nargs='*', help='key=value, напр. device=+25 или what=LO')
+    p.set_defaults(fn=call)
+
+    sub.add_parser('watch', help='выводить измеренные точки').set_defaults(fn=watch)
+
+    parsed = parser.parse_args(args)
+    return parsed.fn(parsed) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,93 @@
+import math
+
+
+class RunningStats:
+
+    def __init__(self):
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.last = math.nan
+
+        self._ss_pow_in = math.inf
+        self.ss_gain = math.nan
+
+    def update(self, gain, pow_in):
+        # Welford's online algorithm, constant time per point
+        self.count += 1
+        delta = gain - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (gain - self.mean)
+
+        self.min = min(self.min, gain)
+        self.max = max(self.max, gain)
+        self.last = gain
+
+        # small-signal gain is the one at the lowest input level seen so far
+        if pow_in < self._ss_pow_in:
+            self._ss_pow_in = pow_in
+            self.ss_gain = gain
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def compression(self):
+        return self.ss_gain - self.last
+
+
+# two-sided 95% Student t quantiles by sample count (count - 1 degrees of freedom);
+# counts between the keys take the next smaller key, the wider interval
+_t95 = {2: 12.71, 3: 4.30, 4: 3.18, 5: 2.78, 6: 2.57, 7: 2.45, 8: 2.37, 9: 2.31, 10: 2.26,
+        11: 2.23, 12: 2.20, 13: 2.18, 14: 2.16, 15: 2.15, 16: 2.13, 20: 2.09, 30: 2.05,
+        60: 2.00, 120: 1.98, 1000: 1.96}
+
+
+def t95(count):
+    if count < 2:
+        return math.inf
+    return _t95[max(n for n in _t95 if n <= count)]
+
+
+class LevelAverage:
+
+    def __init__(self, target, min_count=2, max_count=16, clean_level=None):
+        # target: half-width of the 95% confidence interval on the mean level, dB; 0 takes a single reading
+        # clean_level: a first reading at or above it is far enough out of the noise to stand on its own, dBm
+        self.target = target
+        self.clean_level = clean_level
+        self.min_count = min_count if target > 0 else 1
+        self.max_count = max_count if target > 0 else 1
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, level):
+        self.count += 1
+        delta = level - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (level - self.mean)
+
+    @property
+    def half_width(self):
+        if self.count < 2:
+            return math.inf
+        return t95(self.count) * math.sqrt(self._m2 / (self.count - 1) / self.count)
+
+    @property
+    def done(self):
+        # clean points stop after one reading, noisy ones keep reading until the interval is tight enough
+        if self.count == 1 and self.clean_level is not None and self.mean >= self.clean_level:
+            return True
+        if self.count < self.min_count:
+            return False
+        return self.count >= self.max_count or self.half_width <= self.target
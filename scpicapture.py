@@ -0,0 +1,219 @@
+import gzip
+import json
+import logging
+import threading
+import time
+
+from collections import defaultdict, deque
+
+log = logging.getLogger('rig.session')
+
+# capture file: gzipped JSON lines
+#   header  {"version": 1, "started": <unix time>, "instruments": {name: description}}
+#   entry   [t, name, "s" | "q", command, response]   t -- seconds since the capture started
+capture_version = 1
+
+
+class ReplayError(RuntimeError):
+    pass
+
+
+class ScpiCapture:
+
+    def __init__(self, path):
+        self.path = path
+        self._file = gzip.open(path, mode='wt', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._instruments = dict()
+        self._header_written = False
+
+    def factory(self, name, factory):
+        return RecordingFactory(name, factory, self)
+
+    def add(self, name, instrument):
+        self._instruments[name] = str(instrument)
+
+    def write(self, name, op, command, response=None):
+        t = round(time.monotonic() - self._started, 6)
+        line = json.dumps([t, name, op, command, response], ensure_ascii=False)
+        with self._lock:
+            if not self._header_written:
+                self._write_header()
+            self._file.write(line + '\n')
+
+    def flush(self):
+        # called once per sweep point, a crashed run keeps everything up to the last finished point
+        with self._lock:
+            if self._file.closed:
+                return
+            if not self._header_written:
+                self._write_header()
+            self._file.flush()
+
+    def _write_header(self):
+        self._file.write(json.dumps({
+            'version': capture_version,
+            'started': time.time(),
+            'instruments': self._instruments,
+        }, ensure_ascii=False) + '\n')
+        self._header_written = True
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            if not self._header_written:
+                self._write_header()
+            self._file.close()
+
+
+class RecordingInstrument:
+
+    def __init__(self, name, instrument, capture):
+        self._name = name
+        self._instrument = instrument
+        self._capture = capture
+
+    def __getattr__(self, item):
+        return getattr(self._instrument, item)
+
+    def __bool__(self):
+        return bool(self._instrument)
+
+    def __str__(self):
+        return str(self._instrument)
+
+    @property
+    def unrecorded(self):
+        return self._instrument
+
+    def send(self, command):
+        res = self._instrument.send(command)
+        self._capture.write(self._name, 's', command)
+        return res
+
+    def query(self, question):
+        answer = self._instrument.query(question)
+        self._capture.write(self._name, 'q', question, answer)
+        return answer
+
+
+class RecordingFactory:
+
+    def __init__(self, name, factory, capture):
+        self._name = name
+        self._factory = factory
+        self._capture = capture
+
+    def __getattr__(self, item):
+        return getattr(self._factory, item)
+
+    def find(self):
+        instrument = self._factory.find()
+        if not instrument:
+            return instrument
+        self._capture.add(self._name, instrument)
+        return RecordingInstrument(self._name, instrument, self._capture)
+
+
+class ReplayCapture:
+
+    def __init__(self, path, speed=None):
+        # speed=None serves responses as fast as asked, otherwise keeps the recorded pace scaled by speed
+        self.path = path
+        self.speed = speed
+        self._entries = defaultdict(deque)
+        self._started = None
+        self._lock = threading.Lock()
+
+        with gzip.open(path, mode='rt', encoding='utf-8') as f:
+            self.header = json.loads(f.readline())
+            if self.header.get('version') != capture_version:
+                raise ReplayError(f'{path}: unsupported capture version {self.header.get("version")}')
+            try:
+                for line in f:
+                    t, name, op, command, response = json.loads(line)
+                    self._entries[name].append((t, op, command, response))
+            except (EOFError, ValueError):
+                # capture of a run that crashed, usable up to the last flushed point
+                log.warning('%s: capture truncated, replaying what was recorded', path)
+
+    @property
+    def instruments(self):
+        return self.header.get('instruments', {})
+
+    def factory(self, name):
+        return ReplayFactory(name, self)
+
+    def _pace(self, t):
+        if self.speed is None:
+            return
+        with self._lock:
+            if self._started is None:
+                self._started = time.monotonic() - t / self.speed
+            delay = self._started + t / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def send(self, name, command):
+        entries = self._entries[name]
+        # a send that matches the next recorded one keeps the timeline, anything else is ignored
+        if entries and entries[0][1] == 's' and entries[0][2] == command:
+            self._pace(entries.popleft()[0])
+
+    def query(self, name, question):
+        entries = self._entries[name]
+        while entries and entries[0][1] == 's':
+            entries.popleft()
+        if not entries:
+            raise ReplayError(f'{name}: capture exhausted at {question}')
+        # an unexpected query must not shift every following response by one: look ahead for the
+        # question and drop whatever was recorded before it, or fail without consuming anything
+        for skip, (t, op, recorded, response) in enumerate(entries):
+            if op == 'q' and recorded == question:
+                break
+        else:
+            raise ReplayError(f'{name}: {question} not found in the rest of the capture')
+        if skip:
+            log.warning('%s: replay skipped %d recorded entries before %s', name, skip, question)
+        for _ in range(skip + 1):
+            entries.popleft()
+        self._pace(t)
+        return response
+
+    @property
+    def remaining(self):
+        return {name: len(entries) for name, entries in self._entries.items() if entries}
+
+
+class ReplayInstrument:
+
+    def __init__(self, name, capture):
+        self._name = name
+        self._capture = capture
+
+    def __str__(self):
+        return f'replay {self._capture.instruments.get(self._name, self._name)}'
+
+    @property
+    def status(self):
+        return str(self)
+
+    def send(self, command):
+        self._capture.send(self._name, command)
+
+    def query(self, question):
+        return self._capture.query(self._name, question)
+
+
+class ReplayFactory:
+
+    def __init__(self, name, capture):
+        self.name = name
+        self.addr = capture.path
+        self._capture = capture
+        self._instrument = ReplayInstrument(name, capture)
+
+    def find(self):
+        return self._instrument if self.name in self._capture.instruments else None
@@ -0,0 +1,158 @@
+import logging
+import os.path
+import re
+
+import numpy as np
+import openpyxl
+
+log = logging.getLogger('rig.result')
+
+# spec table header label -> measured value in the processed report
+spec_fields = [
+    (re.compile(r'^P.*1\s*дБ', re.IGNORECASE), 'p_cutoff'),
+    (re.compile(r'^Кп', re.IGNORECASE), 'k_loss'),
+    (re.compile(r'^Iпот|^Iпит', re.IGNORECASE), 'i_mul'),
+    (re.compile(r'^Pпч', re.IGNORECASE), 'p_pch'),
+]
+
+# values checked on every point as it arrives, p_cutoff is only known after process()
+point_fields = ['k_loss', 'i_mul', 'p_pch']
+
+policies = {
+    'continue': 'продолжить',
+    'skip': 'пропустить частоту',
+    'abort': 'прервать',
+}
+
+
+class SpecFailed(RuntimeError):
+    pass
+
+
+def _field_for(label):
+    for pattern, field in spec_fields:
+        if pattern.search(str(label or '').strip()):
+            return field
+    return None
+
+
+class SpecLimits:
+
+    def __init__(self, header=None, limits=None, confirm=2, compression=1.0):
+        self.header = list(header or [])
+        # per header column: (field, lower, upper) or None when the column can't be checked
+        self.columns = list(limits or [])
+        self.confirm = confirm
+        self.compression = compression
+
+        checked = [(i, c) for i, c in enumerate(self.columns) if c is not None and c[0] in point_fields]
+        self._point_columns = [i for i, _ in checked]
+        self._point_index = np.array([point_fields.index(c[0]) for _, c in checked], dtype=int)
+        self._lower = np.array([c[1] for _, c in checked], dtype=float)
+        self._upper = np.array([c[2] for _, c in checked], dtype=float)
+        self._is_gain = np.array([c[0] == 'k_loss' for _, c in checked], dtype=bool)
+
+        self._streaks = dict()
+        self._failed = dict()
+        self._worst = [None] * len(self.columns)
+
+    @classmethod
+    def from_table(cls, table_file, **kwargs):
+        if not table_file or not os.path.isfile(table_file):
+            return cls(**kwargs)
+
+        wb = openpyxl.load_workbook(table_file, read_only=True)
+        ws = wb.active
+        rows = [list(r) for r in ws.iter_rows(min_row=1, max_row=4, values_only=True)]
+        wb.close()
+
+        # header, span, step and mean rows; anything shorter is not a spec table
+        if len(rows) < 4:
+            log.warning('%s: expected 4 rows, found %s, spec limits not applied', table_file, len(rows))
+            return cls(**kwargs)
+
+        header = rows[0][1:]
+        limits = []
+        for j, label in enumerate(header, start=1):
+            span, _, mean = (rows[i][j] if j < len(rows[i]) else None for i in (1, 2, 3))
+            field = _field_for(label)
+            if field is None or not all(isinstance(v, (int, float)) for v in (span, mean)):
+                limits.append(None)
+                continue
+            limits.append((field, mean - span, mean + span))
+        return cls(header=header, limits=limits, **kwargs)
+
+    def __bool__(self):
+        return bool(self._point_columns) or any(c is not None for c in self.columns)
+
+    def reset(self):
+        self._streaks.clear()
+        self._failed.clear()
+        self._worst = [None] * len(self.columns)
+
+    def check_point(self, freq, report, stats):
+        # returns the columns that have just been confirmed failing for `freq`
+        if not self._point_columns:
+            return []
+
+        values = np.array([report[f] for f in point_fields], dtype=float)[self._point_index]
+        # gain is only specified in the linear region, stop checking it once the DUT compresses
+        applicable = ~self._is_gain | (stats.max - report['k_loss'] <= self.compression)
+        fail = applicable & ((values < self._lower) | (values > self._upper))
+
+        for col, value, ok in zip(self._point_columns, values, applicable):
+            if ok:
+                self._track_worst(col, value)
+
+        streak = self._streaks.get(freq)
+        if streak is None:
+            streak = np.zeros(len(self._point_columns), dtype=int)
+        streak = np.where(fail, streak + 1, 0)
+        self._streaks[freq] = streak
+
+        confirmed = streak >= self.confirm
+        failed = self._failed.setdefault(freq, set())
+        new = [self._point_columns[i] for i in np.flatnonzero(confirmed) if self._point_columns[i] not in failed]
+        failed.update(new)
+        return new
+
+    def check_cutoffs(self, cutoffs):
+        for col, c in enumerate(self.columns):
+            if c is None or c[0] != 'p_cutoff':
+                continue
+            for freq, value in cutoffs:
+                self._track_worst(col, value)
+                if not c[1] <= value <= c[2]:
+                    self._failed.setdefault(freq, set()).add(col)
+
+    def _track_worst(self, col, value):
+        _, lower, upper = self.columns[col]
+        centre = (lower + upper) / 2
+        worst = self._worst[col]
+        if worst is None or abs(value - centre) > abs(worst - centre):
+            self._worst[col] = float(value)
+
+    def failed_at(self, freq):
+        return bool(self._failed.get(freq))
+
+    @property
+    def failed(self):
+        return any(self._failed.values())
+
+    def table(self):
+        failed_cols = set().union(*self._failed.values()) if self._failed else set()
+        measured, norm, verdict = [], [], []
+        for col, c in enumerate(self.columns):
+            if c is None:
+                measured.append('-')
+                norm.append('-')
+                verdict.append('-')
+                continue
+            worst = self._worst[col]
+            measured.append('-' if worst is None else round(worst, 2))
+            norm.append(f'{round(c[1], 2)}..{round(c[2], 2)}')
+            if worst is None:
+                verdict.append('-')
+            else:
+                verdict.append('брак' if col in failed_cols else 'годен')
+        return list(self.header), [measured, norm, verdict]
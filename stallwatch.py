@@ -0,0 +1,163 @@
+import datetime
+import os
+import sys
+import threading
+import time
+
+from collections import Counter
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+
+def _stack_key(frame, depth):
+    # innermost frame first, enough of the stack to tell plotting from processing from export
+    key = []
+    while frame is not None and len(key) < depth:
+        code = frame.f_code
+        key.append(f'{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}')
+        frame = frame.f_back
+    return tuple(key)
+
+
+def _format_stacks(stacks, total, limit):
+    lines = []
+    for stack, count in stacks.most_common(limit):
+        lines.append(f'{count:6d} {100 * count / total:5.1f}%  {stack[0]}')
+        lines.extend(f'{"":15}{entry}' for entry in stack[1:])
+    return lines
+
+
+class StackSampler:
+
+    def __init__(self, interval=0.01, depth=12):
+        self._interval = interval
+        self._depth = depth
+        self._stop = threading.Event()
+        self._thread = None
+        self._stacks = Counter()
+        self._leaves = Counter()
+        self._samples = 0
+        self._started = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stacks.clear()
+        self._leaves.clear()
+        self._samples = 0
+        self._started = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=1)
+        self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self._interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = (names.get(ident, str(ident)),) + _stack_key(frame, self._depth)
+                self._stacks[stack] += 1
+                self._leaves[(stack[0], stack[1])] += 1
+            self._samples += 1
+
+    def report(self, limit=20):
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        total = max(sum(self._leaves.values()), 1)
+        lines = [f'samples: {self._samples} over {elapsed:.1f} s, interval {self._interval * 1000:.0f} ms', '',
+                 'top functions (thread, innermost frame):']
+        lines.extend(f'{count:6d} {100 * count / total:5.1f}%  [{thread}] {leaf}'
+                     for (thread, leaf), count in self._leaves.most_common(limit))
+        lines += ['', 'top stacks:']
+        lines.extend(_format_stacks(self._stacks, total, limit // 2))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        with open(path, mode='wt', encoding='utf-8') as f:
+            f.write(self.report())
+
+
+class StallWatchdog(QObject):
+    stalled = pyqtSignal(float)
+
+    def __init__(self, parent=None, threshold=0.25, interval=0.05, path='stalls.log', depth=12):
+        # create on the GUI thread, that is the thread being watched
+        super().__init__(parent=parent)
+        self._threshold = threshold
+        self._interval = interval
+        self._path = path
+        self._depth = depth
+
+        self._main = threading.get_ident()
+        self._last = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stall = None
+        self._stall_from = 0.0
+
+        self.max_latency = 0.0
+        self.stalls = 0
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(int(interval * 1000))
+        self._timer.timeout.connect(self._tick)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._last = time.monotonic()
+        self._timer.start()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name='stall-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._timer.stop()
+        self._stop.set()
+        self._thread.join(timeout=1)
+        self._thread = None
+
+    def _tick(self):
+        self._last = time.monotonic()
+
+    def _watch(self):
+        while not self._stop.wait(self._interval / 2):
+            # latency on top of the timer's own period is how long the event loop was busy
+            lag = time.monotonic() - self._last - self._interval
+            self.max_latency = max(self.max_latency, lag)
+            if lag > self._threshold:
+                if self._stall is None:
+                    self._stall = Counter()
+                    self._stall_from = self._last
+                frame = sys._current_frames().get(self._main)
+                if frame is not None:
+                    self._stall[_stack_key(frame, self._depth)] += 1
+            elif self._stall is not None:
+                self._finish(self._stall, self._last - self._stall_from - self._interval)
+                self._stall = None
+
+    def _finish(self, samples, duration):
+        self.stalls += 1
+        self.stalled.emit(duration)
+        lines = [f'{datetime.datetime.now().isoformat(timespec="seconds")} '
+                 f'GUI stalled ~{duration:.2f} s, {sum(samples.values())} samples']
+        lines.extend(_format_stacks(samples, sum(samples.values()), 3))
+        try:
+            with open(self._path, mode='at', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n\n')
+        except OSError:
+            pass
@@ -0,0 +1,283 @@
+import argparse
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from forgot_again.file import load_ast_if_exists, make_dirs, pprint_to_file
+from rigservice import RigClient, default_port
+
+service_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rigservice.py')
+
+
+def station_addrs(base, spec):
+    # a station is either a full address dict or just the name of its own GPIB interface
+    if isinstance(spec, dict):
+        return dict(spec)
+    return {name: spec + addr[addr.index('::'):] for name, addr in base.items()}
+
+
+class Station:
+
+    def __init__(self, name, addrs, port, root='stations'):
+        self.name = name
+        self.addrs = addrs
+        self.port = port
+        self.path = os.path.join(root, name)
+        self.job = None
+        self.done = 0
+
+        self._process = None
+        self._control = None
+        self._events = None
+        self._finished = threading.Event()
+        self._finished_event = None
+
+    def start(self, timeout=30.0):
+        # every station keeps its own configs, calibration and results in its own directory
+        make_dirs(self.path)
+        pprint_to_file(os.path.join(self.path, 'instr.ini'), self.addrs)
+        if not os.path.exists(os.path.join(self.path, 'params.ini')) and os.path.exists('params.ini'):
+            shutil.copy('params.ini', self.path)
+
+        # spec tables and adjustment files stay in the main directory, shared by all stations
+        self._process = subprocess.Popen(
+            [sys.executable, service_script, '--port', str(self.port), 'serve', '--tables', os.getcwd()],
+            cwd=self.path,
+        )
+        self._control = self._connect(timeout)
+        self._events = self._connect(timeout)
+        self._events.request('subscribe')
+
+    @property
+    def calibrated(self):
+        # calibration belongs to the station's own cables, it is never copied from another station
+        return all(os.path.exists(os.path.join(self.path, f)) for f in ('cal_lo.ini', 'cal_rf.ini'))
+
+    def _connect(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return RigClient(port=self.port)
+            except OSError:
+                if self._process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f'{self.name}: rig service did not start')
+                time.sleep(0.2)
+
+    def listen(self, merged):
+        # separate connection for pushed events, commands on the control connection never wait behind them
+        try:
+            for event in self._events.events():
+                if event['event'] == 'done':
+                    self._finished_event = event
+                    self._finished.set()
+                merged.put((self.name, event))
+        except (ConnectionError, OSError) as ex:
+            merged.put((self.name, {'event': 'lost', 'error': str(ex)}))
+            self._finished_event = None
+            self._finished.set()
+
+    def run_task(self, cmd, **args):
+        self._finished.clear()
+        self._control.request(cmd, **args)
+        self._finished.wait()
+        if self._finished_event is None:
+            raise RuntimeError(f'{self.name}: connection lost')
+        return self._finished_event
+
+    def set_params(self, params):
+        self._control.request('params', **params)
+
+    def cancel(self):
+        try:
+            self._control.request('cancel')
+        except (RuntimeError, OSError):
+            pass
+
+    def stop(self, timeout=30.0):
+        # a running sweep is cancelled first, the service gets to put the rig into the safe state
+        if self.job is not None:
+            self.cancel()
+            self._finished.wait(timeout)
+        for client in (self._control, self._events):
+            if client is not None:
+                client.close()
+        if self._process is not None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+
+
+class Supervisor:
+
+    def __init__(self, stations, calibrate=False):
+        self.stations = stations
+        # calibrate every station before its first job, otherwise uncalibrated stations get no jobs
+        self.calibrate = calibrate
+        self.jobs = queue.Queue()
+        self.events = queue.Queue()
+        self._workers = []
+        # jobs submitted and not finished yet, a re-queued job still counts
+        self._outstanding = 0
+        self._alive = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        for station in self.stations:
+            station.start()
+            threading.Thread(target=station.listen, args=(self.events,), daemon=True).start()
+
+    def submit(self, device, params=None):
+        with self._lock:
+            self._outstanding += 1
+        self.jobs.put((device, params or {}))
+
+    def run(self):
+        # every idle station takes the next job, total throughput scales with the station count
+        self._alive = len(self.stations)
+        for station in self.stations:
+            worker = threading.Thread(target=self._work, args=(station,), name=f'station-{station.name}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self, station):
+        try:
+            self._serve(station)
+        finally:
+            self._retire()
+
+    def _serve(self, station):
+        try:
+            status = station.run_task('connect', addrs=station.addrs)['status']
+        except RuntimeError as ex:
+            self.events.put((station.name, {'event': 'failed', 'error': str(ex)}))
+            return
+        if not status['found']:
+            self.events.put((station.name, {'event': 'failed', 'error': 'instruments not found'}))
+            return
+        if self.calibrate:
+            for what in ('LO', 'RF'):
+                try:
+                    event = station.run_task('calibrate', what=what)
+                except RuntimeError as ex:
+                    event = {'ok': False, 'error': str(ex)}
+                if not event['ok']:
+                    self.events.put((station.name, {'event': 'failed', 'error': f'calibration {what}: {event["error"]}'}))
+                    return
+        if not station.calibrated:
+            # 0 dB deltas would pass for a measurement, the station is left out instead
+            self.events.put((station.name, {'event': 'failed', 'error': 'not calibrated, run with --calibrate'}))
+            return
+
+        while True:
+            try:
+                device, params = self.jobs.get(timeout=0.5)
+            except queue.Empty:
+                # an empty queue is not the end while another station may still hand its job back
+                with self._lock:
+                    if self._outstanding == 0:
+                        return
+                continue
+            station.job = device
+            try:
+                if params:
+                    station.set_params(params)
+                event = station.run_task('measure', device=device)
+            except RuntimeError as ex:
+                self.events.put((station.name, {'event': 'failed', 'error': str(ex)}))
+                self.jobs.put((device, params))
+                return
+            finally:
+                station.job = None
+                self.jobs.task_done()
+            with self._lock:
+                self._outstanding -= 1
+            station.done += 1
+            self.events.put((station.name, {'event': 'job', 'device': device, 'ok': event['ok']}))
+
+    def _retire(self):
+        with self._lock:
+            self._alive -= 1
+            if self._alive > 0:
+                return
+        # the last station is gone, whatever is still queued will never be measured
+        while True:
+            try:
+                device, _ = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._outstanding -= 1
+            self.jobs.task_done()
+            self.events.put(('supervisor', {'event': 'unassigned', 'device': device}))
+
+    @property
+    def running(self):
+        return any(w.is_alive() for w in self._workers)
+
+    def progress(self):
+        return ', '.join(f'{s.name}: {s.job or "-"} ({s.done})' for s in self.stations)
+
+    def stop(self):
+        # all sweeps are cancelled at once, then each station is waited for in turn
+        for station in self.stations:
+            if station.job is not None:
+                station.cancel()
+        for station in self.stations:
+            station.stop()
+
+
+def load_stations(path, base_port=default_port):
+    base = load_ast_if_exists('instr.ini', default={})
+    specs = load_ast_if_exists(path, default={})
+    return [
+        Station(name, station_addrs(base, spec), base_port + index)
+        for index, (name, spec) in enumerate(specs.items())
+    ]
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Параллельное измерение на нескольких стендах')
+    parser.add_argument('stations', help='stations.ini: {"стенд1": "GPIB1", "стенд2": {адреса приборов}}')
+    parser.add_argument('jobs', nargs='+', help='режимы измерения по очереди, напр. +25 +25 -60')
+    parser.add_argument('--port', type=int, default=default_port, help='первый порт сервисов стендов')
+    parser.add_argument('--calibrate', action='store_true', help='калибровать Гет. и Вх. на каждом стенде перед измерениями')
+    parsed = parser.parse_args(args)
+
+    supervisor = Supervisor(load_stations(parsed.stations, parsed.port), calibrate=parsed.calibrate)
+    if not supervisor.stations:
+        print('no stations in', parsed.stations)
+        return 1
+
+    for device in parsed.jobs:
+        supervisor.submit(device)
+
+    try:
+        supervisor.start()
+        supervisor.run()
+        while supervisor.running or not supervisor.events.empty():
+            try:
+                name, event = supervisor.events.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            kind = event['event']
+            if kind == 'point':
+                data = event['data']
+                print(f'[{name}] f_rf={data.get("f_rf_label")} p_rf={data.get("p_rf")} pow={data.get("pow_read")}')
+            elif kind != 'started':
+                print(f'[{name}] {kind}: {event}')
+                print(supervisor.progress())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
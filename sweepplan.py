@@ -0,0 +1,209 @@
+import itertools
+import time
+
+from collections import namedtuple
+
+import numpy as np
+
+from forgot_again.file import load_ast_if_exists, pprint_to_file
+
+SweepPoint = namedtuple('SweepPoint', 'index p_rf delta_rf center_freq rf_commands sa_commands')
+FrequencyStep = namedtuple('FrequencyStep', 'f_lo f_rf f_rf_label delta_lo points')
+
+sweep_modes = {
+    'zip': 'попарно',
+    'grid': 'Fгет x Fвх',
+    'const_if': 'пост. ПЧ',
+}
+
+
+def value_grid(start, stop, step, tail=0.002):
+    return [round(x, 3) for x in np.arange(start=start, stop=stop + tail, step=step)]
+
+
+def format_duration(seconds):
+    seconds = int(round(max(seconds, 0)))
+    h, rest = divmod(seconds, 3600)
+    m, s = divmod(rest, 60)
+    return f'{h}:{m:02d}:{s:02d}' if h else f'{m:02d}:{s:02d}'
+
+
+class SweepPlan:
+
+    def __init__(self, secondary, cal_lo=None, cal_rf=None):
+        self.secondary = dict(secondary)
+
+        self.pow_lo = secondary['Plo']
+        self.lo_x2 = secondary['is_Flo_x2']
+
+        self.pow_values = value_grid(secondary['Prf_min'], secondary['Prf_max'], secondary['Prf_delta'])
+        self.lo_values = value_grid(secondary['Flo_min'], secondary['Flo_max'], secondary['Flo_delta'])
+        self.rf_values = value_grid(secondary['Frf_min'], secondary['Frf_max'], secondary['Frf_delta'])
+
+        self.cal_lo_values = value_grid(secondary['Flo_min'], secondary['Flo_max'], secondary['Flo_delta'], tail=0.0001)
+        if self.lo_x2:
+            self.cal_lo_values = [f * 2 for f in self.cal_lo_values]
+
+        self.mode = secondary.get('sweep_mode', 'zip')
+        self.dropped = 0
+        self.uncalibrated = 0
+        pairs = self._pairs()
+
+        # with one IF for the whole sweep the analyzer is tuned once and only the generators move
+        centers = {round((f_rf - f_lo), 6) for f_lo, f_rf, _ in pairs}
+        self.fixed_if = centers.pop() if len(centers) == 1 else None
+        self.if_commands = () if self.fixed_if is None else (
+            ':CALC:MARK1:MODE POS',
+            f':SENSe:FREQuency:CENTer {self.fixed_if}GHz',
+            f':CALCulate:MARKer1:X:CENTer {self.fixed_if}GHz',
+        )
+
+        self.frequencies = self._compile(pairs, cal_lo or {}, cal_rf or {})
+
+    def _pairs(self):
+        # (f_lo before x2, f_rf, curve label)
+        if self.mode == 'grid':
+            return [(f_lo, f_rf, f'{f_rf}/{f_lo}') for f_lo, f_rf in itertools.product(self.lo_values, self.rf_values)]
+
+        if self.mode == 'const_if':
+            f_if = self.secondary.get('f_if') or round(self.rf_values[0] - self.lo_values[0], 6)
+            return [(round(f_rf - f_if, 6), f_rf, float(f_rf)) for f_rf in self.rf_values]
+
+        # zip pairs the lists index by index, report what the shorter list cuts off instead of dropping it silently
+        self.dropped = abs(len(self.lo_values) - len(self.rf_values))
+        return [(f_lo, f_rf, float(f_rf)) for f_lo, f_rf in zip(self.lo_values, self.rf_values)]
+
+    def _compile(self, pairs, cal_lo, cal_rf):
+        steps = []
+        index = 0
+        for f_lo, f_rf, f_rf_label in pairs:
+            center_freq = round(f_rf - f_lo, 6)
+            if self.lo_x2:
+                f_lo *= 2
+
+            delta_lo = round(self._cal_lo(cal_lo, f_lo) / 2, 2)
+
+            points = []
+            for p_rf in self.pow_values:
+                delta_rf = round(cal_rf.get(f_rf, dict()).get(p_rf, 0) / 2, 2)
+                points.append(SweepPoint(
+                    index=index,
+                    p_rf=p_rf,
+                    delta_rf=delta_rf,
+                    center_freq=center_freq,
+                    rf_commands=(f'SOUR:POW {p_rf + delta_rf}dbm',),
+                    sa_commands=() if self.fixed_if is not None else (
+                        ':CALC:MARK1:MODE POS',
+                        f':SENSe:FREQuency:CENTer {center_freq}GHz',
+                        f':CALCulate:MARKer1:X:CENTer {center_freq}GHz',
+                    ),
+                ))
+                index += 1
+            steps.append(FrequencyStep(f_lo, f_rf, f_rf_label, delta_lo, points))
+        return steps
+
+    def _cal_lo(self, cal_lo, f_lo):
+        # const IF puts the LO between the calibrated frequencies, interpolate between the neighbours;
+        # outside the calibrated range the edge value is used and the frequency is reported
+        if f_lo in cal_lo or not cal_lo:
+            return cal_lo.get(f_lo, 0)
+        freqs = sorted(cal_lo)
+        if not freqs[0] <= f_lo <= freqs[-1]:
+            self.uncalibrated += 1
+        return float(np.interp(f_lo, freqs, [cal_lo[f] for f in freqs]))
+
+    @property
+    def point_count(self):
+        return sum(len(s.points) for s in self.frequencies)
+
+    @property
+    def frequency_count(self):
+        return len(self.frequencies)
+
+    def __iter__(self):
+        for step in self.frequencies:
+            for point in step.points:
+                yield step, point
+
+
+class TimingModel:
+    default_coefs = (1.2, 0.5, 5.0)   # s per point, s per frequency, s per run
+
+    def __init__(self, path='timing.ini', history=20):
+        self._path = path
+        self._history = history
+        self._runs = load_ast_if_exists(path, default=[])
+        self.coefs = self._fit()
+
+    def add_run(self, points, frequencies, seconds):
+        if points <= 0:
+            return
+        self._runs.append({'points': points, 'frequencies': frequencies, 'seconds': round(seconds, 2)})
+        self._runs = self._runs[-self._history:]
+        pprint_to_file(self._path, self._runs)
+        self.coefs = self._fit()
+
+    def _fit(self):
+        if not self._runs:
+            return self.default_coefs
+        points = np.array([r['points'] for r in self._runs], dtype=float)
+        freqs = np.array([r['frequencies'] for r in self._runs], dtype=float)
+        secs = np.array([r['seconds'] for r in self._runs], dtype=float)
+        if len(self._runs) < 3:
+            return secs.sum() / points.sum(), 0.0, 0.0
+        a = np.column_stack([points, freqs, np.ones_like(points)])
+        coefs, *_ = np.linalg.lstsq(a, secs, rcond=None)
+        if (coefs < 0).any():
+            return secs.sum() / points.sum(), 0.0, 0.0
+        return tuple(float(c) for c in coefs)
+
+    def estimate(self, plan, duts=1):
+        # a point is one reading: a switch matrix run takes one per DUT at every generator state
+        per_point, per_freq, overhead = self.coefs
+        return plan.point_count * duts * per_point + plan.frequency_count * per_freq + overhead
+
+
+class EtaTracker:
+
+    def __init__(self, smoothing=0.2):
+        self._smoothing = smoothing
+        self.total = 0
+        self.done = 0
+        self.estimate = 0.0
+        self._per_point = 0.0
+        self._started = None
+        self._last = None
+
+    def start(self, plan, model, duts=1):
+        # progress counts generator states, each one covers every DUT
+        self.total = plan.point_count
+        self.done = 0
+        self.estimate = model.estimate(plan, duts)
+        self._per_point = self.estimate / self.total if self.total else 0.0
+        self._started = self._last = time.monotonic()
+
+    def point_done(self):
+        now = time.monotonic()
+        dt = now - self._last
+        self._last = now
+        self.done += 1
+        # the model estimate seeds the average, real timings take over as they come in
+        self._per_point += self._smoothing * (dt - self._per_point)
+
+    def skip(self, count):
+        self.total -= count
+
+    @property
+    def elapsed(self):
+        if self._started is None:
+            return 0.0
+        return time.monotonic() - self._started
+
+    @property
+    def remaining(self):
+        return max(self.total - self.done, 0) * self._per_point
+
+    @property
+    def text(self):
+        return f'Точка {self.done}/{self.total}, прошло {format_duration(self.elapsed)}, ' \
+               f'осталось ~{format_duration(self.remaining)}'
@@ -0,0 +1,81 @@
+import logging
+
+from instr.instrumentfactory import mock_enabled
+
+log = logging.getLogger('rig.session')
+
+
+class SwitchMatrix:
+    # 1xN RF switch: channel n routes DUT n to the analyzer and the supply sense
+    model = 'switch matrix'
+
+    def __init__(self, addr, resource):
+        self.addr = addr
+        self._resource = resource
+
+    def __str__(self):
+        return f'{self.model} at {self.addr}'
+
+    @property
+    def status(self):
+        return str(self)
+
+    def send(self, command):
+        self._resource.write(command)
+
+    def query(self, question):
+        return self._resource.query(question)
+
+
+class SwitchMatrixMock:
+    model = 'switch matrix mock'
+
+    def __init__(self, addr, channels=8):
+        self.addr = addr
+        self.channels = channels
+        self.closed = None
+
+    def __str__(self):
+        return f'{self.model} at {self.addr}'
+
+    @property
+    def status(self):
+        return str(self)
+
+    def send(self, command):
+        header, _, arg = command.partition(' ')
+        if header.upper() in ('ROUT:CLOS', ':ROUT:CLOS', 'ROUT:CLOS:EXCL', ':ROUT:CLOS:EXCL'):
+            self.closed = int(arg.strip('(@)').split('!')[-1])
+        elif header.upper() in ('*RST', 'ROUT:OPEN:ALL', ':ROUT:OPEN:ALL'):
+            self.closed = None
+
+    def query(self, question):
+        if question.upper() in ('ROUT:CLOS?', ':ROUT:CLOS?'):
+            return f'(@{self.closed})' if self.closed is not None else '(@)'
+        if question.upper() == '*IDN?':
+            return f'mock,{self.model},0,0'
+        return '0'
+
+
+class SwitchMatrixFactory:
+
+    def __init__(self, addr):
+        self.addr = addr
+
+    def find(self):
+        if mock_enabled:
+            return SwitchMatrixMock(self.addr)
+        try:
+            import pyvisa
+            resource = pyvisa.ResourceManager().open_resource(self.addr)
+            idn = resource.query('*IDN?')
+        except Exception as ex:
+            log.info('switch matrix not found at %s: %s', self.addr, ex)
+            return None
+        log.info('switch matrix at %s: %s', self.addr, idn.strip())
+        return SwitchMatrix(self.addr, resource)
+
+
+def close_command(channel):
+    # a plain CLOS adds to the closed channels on most cards, the previous DUT would stay connected
+    return f'ROUT:CLOS:EXCL (@{channel})'
@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+
+# <name>.npy     -- float32 [points x trace length], one analyzer trace per sweep point
+# <name>.idx.npy -- one index row per trace: which point it belongs to and how to rebuild the frequency axis
+index_dtype = np.dtype([
+    ('valid', '?'),
+    ('dut', 'i4'),
+    ('f_lo', 'f8'),
+    ('f_rf', 'f8'),
+    ('p_rf', 'f8'),
+    ('center', 'f8'),   # GHz
+    ('span', 'f8'),     # Hz
+])
+
+
+def index_path(path):
+    root, _ = os.path.splitext(path)
+    return root + '.idx.npy'
+
+
+class TraceStore:
+
+    def __init__(self, traces, index, path):
+        self._traces = traces
+        self._index = index
+        self.path = path
+
+    @classmethod
+    def create(cls, path, points, trace_len):
+        # preallocated on disk up front, capture does not grow memory with the sweep
+        traces = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(points, trace_len))
+        traces[:] = np.nan
+        index = np.lib.format.open_memmap(index_path(path), mode='w+', dtype=index_dtype, shape=(points,))
+        index['valid'] = False
+        return cls(traces, index, path)
+
+    @classmethod
+    def open(cls, path):
+        # read-only view, rows are paged in only when they are looked at
+        return cls(np.load(path, mmap_mode='r'), np.load(index_path(path), mmap_mode='r'), path)
+
+    def __len__(self):
+        return int(self._index['valid'].sum())
+
+    @property
+    def trace_len(self):
+        return self._traces.shape[1]
+
+    def put(self, row, trace, f_lo, f_rf, p_rf, center, span, dut=1):
+        n = min(len(trace), self.trace_len)
+        self._traces[row, :n] = trace[:n]
+        self._index[row] = (True, dut, f_lo, f_rf, p_rf, center, span)
+
+    def rows(self, f_lo=None, f_rf=None, p_rf=None, dut=None):
+        mask = self._index['valid'].copy()
+        for field, value in (('f_lo', f_lo), ('f_rf', f_rf), ('p_rf', p_rf), ('dut', dut)):
+            if value is not None:
+                mask &= np.isclose(self._index[field], value)
+        return np.flatnonzero(mask)
+
+    def trace(self, row):
+        entry = self._index[row]
+        freqs = entry['center'] * 1e9 + np.linspace(-entry['span'] / 2, entry['span'] / 2, self.trace_len)
+        return freqs, np.asarray(self._traces[row])
+
+    def index(self):
+        return np.asarray(self._index)
+
+    def flush(self):
+        self._traces.flush()
+        self._index.flush()
+
+    def close(self):
+        self.flush()
+        self._traces = self._index = None